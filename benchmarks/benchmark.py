@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Benchmarks for the wire codec, message signing and report building.
+
+Run from the top of the source tree:
+
+    $ python3 benchmarks/benchmark.py --save baseline.json
+    $ python3 benchmarks/benchmark.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# Benchmark the source tree the script is in, not an installed version
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from tellive.livemessage import LiveMessage
+from tellive.tellstick import TellstickLiveClient
+
+PRIVATE_KEY = "PES7ANEWURUPHANETUJUPEGEKAWUFAHE"
+HASH_METHODS = ("sha1", "sha256", "sha512")
+
+NUM_DEVICES = 500
+NUM_SENSORS = 200
+
+# tellcore constants, copied to not depend on tellcore being installed
+TELLSTICK_TURNON = 1
+TELLSTICK_TURNOFF = 2
+TELLSTICK_DIM = 16
+TELLSTICK_TEMPERATURE = 1
+TELLSTICK_HUMIDITY = 2
+
+
+class FakeDevice(object):
+    def __init__(self, id):
+        super().__init__()
+        self.id = id
+        self.name = "Device number {}".format(id)
+
+    def methods(self, methods_supported):
+        return methods_supported & (TELLSTICK_TURNON | TELLSTICK_TURNOFF
+                                    | TELLSTICK_DIM)
+
+    def last_sent_command(self, methods_supported):
+        return TELLSTICK_DIM
+
+    def last_sent_value(self):
+        return self.id % 256
+
+
+class FakeSensorValue(object):
+    def __init__(self, value, timestamp):
+        super().__init__()
+        self.value = value
+        self.timestamp = timestamp
+
+
+class FakeSensor(object):
+    DATATYPES = {"temperature": TELLSTICK_TEMPERATURE,
+                 "humidity": TELLSTICK_HUMIDITY}
+
+    def __init__(self, id):
+        super().__init__()
+        self.id = id
+        self.protocol = "fineoffset"
+        self.model = "temperaturehumidity"
+        self.timestamp = 1416915600 + id
+
+    def has_value(self, datatype):
+        return True
+
+    def value(self, datatype):
+        return FakeSensorValue("{}.{}".format(datatype, self.id % 10),
+                               self.timestamp)
+
+
+class FakeSocket(object):
+    def __init__(self):
+        super().__init__()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+
+def command_message():
+    message = LiveMessage("command")
+    message.append({'id': 17, 'action': "dim", 'value': 128,
+                    'ACK': 123456})
+    return message
+
+
+def devices_report():
+    devices = [FakeDevice(i) for i in range(NUM_DEVICES)]
+    dev_list = []
+    for device in devices:
+        dev_list.append({'id': device.id, 'name': device.name,
+                         'methods': device.methods(0xff),
+                         'state': device.last_sent_command(0xff),
+                         'stateValue': str(device.last_sent_value())})
+    message = LiveMessage("DevicesReport")
+    message.append(dev_list)
+    return message
+
+
+def sensors_report():
+    sensor_list = []
+    for i in range(NUM_SENSORS):
+        sensor = FakeSensor(i)
+        s = {'protocol': sensor.protocol, 'model': sensor.model,
+             'sensor_id': sensor.id, 'name': "Sensor {}".format(i)}
+        values = [{'type': t, 'value': sensor.value(t).value,
+                   'lastUp': sensor.timestamp}
+                  for t in sensor.DATATYPES.values()]
+        sensor_list.append([s, values])
+    message = LiveMessage("SensorsReport")
+    message.append(sensor_list)
+    return message
+
+
+def client():
+    client = TellstickLiveClient("public", PRIVATE_KEY)
+    client.socket = FakeSocket()
+    return client
+
+
+def benchmarks():
+    """Return a list of (name, function) to benchmark."""
+    result = []
+    payloads = [("command", command_message()),
+                ("devices_report", devices_report()),
+                ("sensors_report", sensors_report())]
+
+    for name, message in payloads:
+        data = bytes(message.serialize())
+        result.append(("serialize." + name, message.serialize))
+        result.append(("deserialize." + name,
+                       lambda data=data: LiveMessage.deserialize(data)))
+
+    for name, message in payloads:
+        for hash_method in HASH_METHODS:
+            envelope = message.create_signed_message(PRIVATE_KEY, hash_method)
+            result.append((
+                "sign.{}.{}".format(name, hash_method),
+                lambda m=message, h=hash_method:
+                    m.serialize_signed(PRIVATE_KEY, h)))
+            result.append((
+                "verify.{}.{}".format(name, hash_method),
+                lambda e=envelope, h=hash_method:
+                    e.verify_signature(PRIVATE_KEY, h)))
+
+    devices = [FakeDevice(i) for i in range(NUM_DEVICES)]
+    sensors = [FakeSensor(i) for i in range(NUM_SENSORS)]
+    c = client()
+
+    def receive(data):
+        c.decoder.feed(data)
+        c._decode_received()
+        c.received.clear()
+
+    for name, message in payloads:
+        data = bytes(message.serialize_signed(PRIVATE_KEY, "sha1"))
+        result.append(("receive." + name, lambda data=data: receive(data)))
+
+    result.append(("report_devices",
+                   lambda: c.report_devices(devices, 0xff)))
+    result.append(("report_sensors",
+                   lambda: c.report_sensors(
+                       sensors, name_function=lambda s: "Sensor")))
+    return result
+
+
+def measure(function, min_time, repeat):
+    """Return (ops/s, bytes allocated per op) for function."""
+    # Calibrate the number of calls so that all runs take about min_time
+    target = min_time / repeat
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target / 10:
+            break
+        number *= 2
+    number = max(1, int(number * target / elapsed))
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    try:
+        function()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        allocated = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return number / best, max(0, allocated)
+
+
+def compare(results, baseline, threshold):
+    """Print results compared to baseline.
+
+    :return: True if no benchmark is slower than threshold (percent)
+    """
+    ok = True
+    print("{:<40} {:>14} {:>14} {:>8}".format(
+        "benchmark", "ops/s", "baseline", "change"))
+    for name, value in sorted(results.items()):
+        if name not in baseline:
+            print("{:<40} {:>14.1f} {:>14} {:>8}".format(
+                name, value['ops'], "-", "new"))
+            continue
+        old = baseline[name]['ops']
+        change = (value['ops'] - old) / old * 100
+        flag = ""
+        if change < -threshold:
+            flag = " REGRESSION"
+            ok = False
+        print("{:<40} {:>14.1f} {:>14.1f} {:>+7.1f}%{}".format(
+            name, value['ops'], old, change, flag))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', '--filter', default="",
+                        help="Only run benchmarks containing this string")
+    parser.add_argument('-t', '--time', type=float, default=1.0,
+                        help="Approximate seconds to run each benchmark")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of timed runs, the best one is used")
+    parser.add_argument('--save', metavar='FILE',
+                        help="Save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Compare the results to a JSON baseline")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="Allowed slowdown in percent when comparing")
+    args = parser.parse_args()
+
+    results = {}
+    print("{:<40} {:>14} {:>14}".format("benchmark", "ops/s", "bytes/op"))
+    for name, function in benchmarks():
+        if args.filter not in name:
+            continue
+        ops, allocated = measure(function, args.time, args.repeat)
+        results[name] = {'ops': ops, 'allocated': allocated}
+        print("{:<40} {:>14.1f} {:>14d}".format(name, ops, allocated))
+
+    ok = True
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print()
+        ok = compare(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""A local stand-in for the Telldus Live servers.
+
+Speaks enough of the protocol to exercise TellstickLiveClient, the
+connector and load_generator.py without the real servers:
+
+- GET /server/assign on the assign port lists the stand-in itself
+- Register is answered with registered, or notregistered if the client
+  has no uuid
+- Ping is answered with pong
+- commands can be pushed to all registered clients in bursts and the time
+  until each is ACKed is measured
+
+Both ports use TLS. Without --certfile a self-signed certificate for
+localhost is created with the openssl command, and its path is printed so
+that clients can trust it:
+
+    $ python3 benchmarks/live_server.py --burst 100 --interval 5
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+# Use the source tree the script is in, not an installed version
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from tellive.livemessage import LiveMessage, LiveMessageDecoder
+
+# Key of tellive_core_connector
+PRIVATE_KEY = "PES7ANEWURUPHANETUJUPEGEKAWUFAHE"
+
+# All methods in tellcore.constants
+SUPPORTED_METHODS = 0x3ff
+
+
+def make_certificate(directory, host="localhost"):
+    """Create a self-signed certificate for host.
+
+    :return: (certfile, keyfile)
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-days", "1", "-subj", "/CN=" + host,
+         "-addext", "subjectAltName=DNS:" + host,
+         "-keyout", keyfile, "-out", certfile],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Session(object):
+    """A client connected to the LiveServer."""
+    def __init__(self, server, writer):
+        super().__init__()
+        self.server = server
+        self.writer = writer
+        self.decoder = LiveMessageDecoder()
+        self.hash_method = "sha1"
+        self.uuid = None
+        self.registered = False
+
+    def send(self, subject, *parameters):
+        message = LiveMessage(subject)
+        for parameter in parameters:
+            message.append(parameter)
+        self.writer.write(message.serialize_signed(self.server.private_key,
+                                                   self.hash_method))
+        self.server.sent[subject] += 1
+
+    def disconnect(self):
+        self.send("disconnect")
+        self.writer.close()
+
+
+class LiveServer(object):
+    """The stand-in server, see the module documentation."""
+    def __init__(self, private_key=PRIVATE_KEY,
+                 supported_methods=SUPPORTED_METHODS):
+        super().__init__()
+        self.private_key = private_key
+        self.supported_methods = supported_methods
+        self.address = None
+        self.sessions = set()
+        self.servers = []
+        # Number of messages per subject
+        self.received = collections.Counter()
+        self.sent = collections.Counter()
+        self.connects = 0
+        self._cookies = itertools.count(1)
+        # cookie -> time.perf_counter() when the command was sent
+        self.unacked = {}
+        self.ack_latencies = []
+
+    async def start(self, ssl_context, host="localhost", port=0,
+                    assign_port=0):
+        """Start listening.
+
+        :return: ((host, port), (host, assign port)) listened on
+        """
+        live = await asyncio.start_server(self._handle_client, host, port,
+                                          ssl=ssl_context)
+        assign = await asyncio.start_server(self._handle_assign, host,
+                                            assign_port, ssl=ssl_context)
+        self.servers = [live, assign]
+        self.address = (host, live.sockets[0].getsockname()[1])
+        return self.address, (host, assign.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        for session in list(self.sessions):
+            session.writer.close()
+
+    async def _handle_assign(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request.startswith(b'GET /server/assign'):
+                body = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<servers><server address="{}" port="{}"/>'
+                        '</servers>\n').format(*self.address)
+                status = "200 OK"
+            else:
+                body, status = "", "404 Not Found"
+            body = body.encode('utf-8')
+            writer.write("HTTP/1.1 {}\r\nContent-Type: text/xml\r\n"
+                         "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                         .format(status, len(body)).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except (OSError, ssl.SSLError) as e:
+            logging.debug("Assign request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def _handle_client(self, reader, writer):
+        session = Session(self, writer)
+        self.sessions.add(session)
+        self.connects += 1
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                session.decoder.feed(data)
+                for envelope in session.decoder.envelopes():
+                    if not envelope.verify_signature(self.private_key,
+                                                     session.hash_method):
+                        raise ValueError("Signature verification failed")
+                    self.handle_message(session, LiveMessage.deserialize(
+                        envelope.parameter(0).encode('utf-8')))
+                await writer.drain()
+        except (OSError, ValueError, ssl.SSLError) as e:
+            logging.debug("Client error: %s", e)
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def handle_message(self, session, message):
+        subject = message.subject()
+        self.received[subject] += 1
+
+        if subject == "register":
+            params = message.parameter(0)
+            session.hash_method = params.get('hash', "sha1")
+            session.uuid = params.get('uuid')
+            if session.uuid:
+                session.registered = True
+                session.send("registered",
+                             {'supportedMethods': self.supported_methods,
+                              'uuid': session.uuid})
+            else:
+                uuid = "standin-{}".format(self.connects)
+                session.send("notregistered",
+                             {'uuid': uuid,
+                              'url': "https://localhost/activate?uuid="
+                              + uuid})
+
+        elif subject == "ping":
+            session.send("pong")
+
+        elif subject == "ack":
+            sent = self.unacked.pop(message.parameter(0), None)
+            if sent is not None:
+                self.ack_latencies.append(time.perf_counter() - sent)
+
+    def command(self, session, device_id, action, value=None):
+        """Send a command to a client.
+
+        :return: the ACK cookie
+        """
+        cookie = next(self._cookies)
+        params = {'id': device_id, 'action': action, 'ACK': cookie}
+        if value is not None:
+            params['value'] = value
+        self.unacked[cookie] = time.perf_counter()
+        session.send("command", params)
+        return cookie
+
+    def burst(self, count, action="dim"):
+        """Send count commands to each registered client.
+
+        :return: number of commands sent
+        """
+        sent = 0
+        for session in list(self.sessions):
+            if not session.registered:
+                continue
+            for i in range(count):
+                self.command(session, i % 10 + 1, action,
+                             i % 256 if action == "dim" else None)
+                sent += 1
+        return sent
+
+    def disconnect_all(self):
+        """Ask all clients to disconnect, e.g. to cause a reconnect storm."""
+        for session in list(self.sessions):
+            session.disconnect()
+
+    def report(self):
+        latencies = self.ack_latencies
+        return ("clients={} connects={} received={} acked={} unacked={} "
+                "ack p50={:.2f}ms p99={:.2f}ms".format(
+                    len(self.sessions), self.connects,
+                    sum(self.received.values()), len(latencies),
+                    len(self.unacked),
+                    percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000))
+
+
+async def run(args):
+    if args.certfile:
+        certfile, keyfile = args.certfile, args.keyfile
+    else:
+        directory = tempfile.mkdtemp(prefix="tellive-")
+        certfile, keyfile = make_certificate(directory, args.host)
+        print("Certificate: {}".format(certfile))
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+
+    server = LiveServer()
+    address, assign = await server.start(context, args.host, args.port,
+                                         args.assign_port)
+    print("Listening on {}:{}, server list on https://{}:{}"
+          "/server/assign".format(address[0], address[1], *assign))
+
+    try:
+        while True:
+            await asyncio.sleep(args.interval)
+            if args.burst:
+                server.burst(args.burst)
+            print(server.report())
+            del server.ack_latencies[:]
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Telldus Live servers")
+    parser.add_argument('--host', default="localhost")
+    parser.add_argument('--port', type=int, default=50000,
+                        help="port for the Live protocol")
+    parser.add_argument('--assign-port', type=int, default=50001,
+                        help="port for the server list")
+    parser.add_argument('--certfile', help="TLS certificate (PEM)")
+    parser.add_argument('--keyfile', help="TLS private key (PEM)")
+    parser.add_argument('--burst', type=int, default=0, metavar='N',
+                        help="send N commands to each client every interval")
+    parser.add_argument('--interval', type=float, default=5,
+                        help="seconds between bursts and reports")
+    parser.add_argument('-d', '--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Simulates many TellStick clients connected to a Live server.
+
+Each client registers, ACKs the commands it gets and reports sensor events
+at a fixed rate. Meant to be run against live_server.py:
+
+    $ python3 benchmarks/live_server.py --burst 10
+    $ python3 benchmarks/load_generator.py --clients 2000 \\
+        --cafile /tmp/tellive-.../cert.pem
+
+Remember to raise the limit of open files (ulimit -n) for large numbers of
+clients.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import ssl
+import sys
+import time
+
+# Use the source tree the script is in, not an installed version
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import tellive
+from tellive.aiotellstick import AsyncTellstickLiveClient
+
+# Keys of tellive_core_connector
+PUBLIC_KEY = "THETECHET2STUSWAGACRUWEFU5EWUW5W"
+PRIVATE_KEY = "PES7ANEWURUPHANETUJUPEGEKAWUFAHE"
+
+TELLSTICK_TEMPERATURE = 1
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Stats(object):
+    def __init__(self):
+        super().__init__()
+        self.connected = 0
+        self.connects = 0
+        self.failures = 0
+        self.commands = 0
+        self.sensor_events = 0
+        self.connect_latencies = []
+
+    def report(self, elapsed):
+        line = ("connected={} connects={} failures={} commands/s={:.0f} "
+                "events/s={:.0f} connect p50={:.1f}ms p99={:.1f}ms".format(
+                    self.connected, self.connects, self.failures,
+                    self.commands / elapsed, self.sensor_events / elapsed,
+                    percentile(self.connect_latencies, 50) * 1000,
+                    percentile(self.connect_latencies, 99) * 1000))
+        self.commands = self.sensor_events = 0
+        del self.connect_latencies[:]
+        return line
+
+
+async def report_sensors(client, index, interval, stats):
+    sensor_id = 0
+    while True:
+        await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+        sensor_id = (sensor_id + 1) % 10
+        value = "{:.1f}".format(random.uniform(15, 25))
+        await client.report_sensor_event(
+            "fineoffset", "temperature", sensor_id,
+            [(TELLSTICK_TEMPERATURE, value, int(time.time()))])
+        stats.sensor_events += 1
+
+
+async def simulate(index, args, context, servers, connecting, stats):
+    """Run one client, reconnecting until cancelled."""
+    client = AsyncTellstickLiveClient(PUBLIC_KEY, PRIVATE_KEY,
+                                      ssl_context=context)
+    client.server_cache = list(servers)
+    client.server_cache_time = time.time()
+
+    while True:
+        sensors = None
+        try:
+            async with connecting:
+                start = time.perf_counter()
+                await client.connect_to_first_available_server()
+            stats.connect_latencies.append(time.perf_counter() - start)
+            stats.connects += 1
+            stats.connected += 1
+            try:
+                await client.register(version=tellive.__version__,
+                                      uuid="load-{}".format(index))
+                async for message in client:
+                    subject = message.subject()
+                    if subject == client.SUBJECT_COMMAND:
+                        stats.commands += 1
+                        params = message.parameter(0)
+                        if 'ACK' in params:
+                            await client.acknowledge(params['ACK'])
+                    elif subject == client.SUBJECT_REGISTERD \
+                            and sensors is None and args.sensor_interval:
+                        sensors = asyncio.ensure_future(report_sensors(
+                            client, index, args.sensor_interval, stats))
+                    elif subject == client.SUBJECT_DISCONNECT:
+                        break
+            finally:
+                stats.connected -= 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.debug("Client %d: %s", index, e)
+            stats.failures += 1
+        finally:
+            if sensors:
+                sensors.cancel()
+            await client.disconnect()
+        await asyncio.sleep(random.uniform(0, args.reconnect_delay))
+
+
+async def run(args):
+    context = ssl.create_default_context(cafile=args.cafile)
+    # Only fetch the server list once instead of once per client
+    fetcher = AsyncTellstickLiveClient(PUBLIC_KEY, PRIVATE_KEY,
+                                       ssl_context=context)
+    loop = asyncio.get_event_loop()
+    servers = await loop.run_in_executor(
+        None, fetcher.servers, args.host, args.assign_port)
+
+    stats = Stats()
+    connecting = asyncio.Semaphore(args.connect_parallel)
+    tasks = [asyncio.ensure_future(
+        simulate(i, args, context, servers, connecting, stats))
+        for i in range(args.clients)]
+    try:
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(args.interval)
+            now = time.perf_counter()
+            print(stats.report(now - last))
+            last = now
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate many TellStick clients")
+    parser.add_argument('--host', default="localhost",
+                        help="host to get the server list from")
+    parser.add_argument('--assign-port', type=int, default=50001)
+    parser.add_argument('--cafile', required=True,
+                        help="certificate of the server to trust")
+    parser.add_argument('-n', '--clients', type=int, default=100)
+    parser.add_argument('--connect-parallel', type=int, default=50,
+                        help="max number of clients connecting at once")
+    parser.add_argument('--sensor-interval', type=float, default=10,
+                        help="mean seconds between sensor events per client "
+                        "(0 to disable)")
+    parser.add_argument('--reconnect-delay', type=float, default=5,
+                        help="max seconds to wait before reconnecting")
+    parser.add_argument('--interval', type=float, default=5,
+                        help="seconds between reports")
+    parser.add_argument('-d', '--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+from .client import LiveClient, REQUESTS, REQUEST_SECONDS, _json_path, \
+    _parse_token, _parse_values
+from .httpresponse import read_response
+
+import asyncio
+import http.client as http
+import logging
+import time
+
+
+class AsyncLiveClient(LiveClient):
+    """asyncio version of LiveClient.
+
+    Requests are sent over keep-alive connections using asyncio streams, so
+    many requests can be outstanding at the same time without using a thread
+    for each.
+    """
+    async def close(self):
+        """Close all idle connections."""
+        connections, self._connections = self._connections, []
+        for reader, writer in connections:
+            writer.close()
+
+    async def _connection(self):
+        while self._connections:
+            reader, writer = self._connections.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer), True
+            logging.debug("Idle connection to %s:%d closed by server",
+                          self.server, self.port)
+            writer.close()
+        connection = await asyncio.open_connection(self.server, self.port)
+        return connection, False
+
+    def _release(self, connection):
+        if len(self._connections) < self.POOL_SIZE:
+            self._connections.append(connection)
+        else:
+            connection[1].close()
+
+    async def _request(self, path, token, secret):
+        """Send a signed request and return the response body.
+
+        The request is only sent again if it could not be written to a
+        reused connection, as it may e.g. turn on a device.
+        """
+        host = self.server
+        if self.port != http.HTTP_PORT:
+            host += ":{}".format(self.port)
+        label = path.split('?')[0]
+        start = time.perf_counter()
+
+        while True:
+            # Signed for each attempt, as the nonce must not be reused
+            uri, headers, body = self._signer(token, secret).sign(
+                self.host + path)
+            request = ["GET {} HTTP/1.1".format(path),
+                       "Host: {}".format(host)]
+            request.extend("{}: {}".format(k, v) for k, v in headers.items())
+            request = ("\r\n".join(request) + "\r\n\r\n").encode('latin-1')
+
+            connection, reused = await self._connection()
+            reader, writer = connection
+            try:
+                writer.write(request)
+                await writer.drain()
+            except OSError:
+                writer.close()
+                # The server may have closed an idle connection, retry with
+                # another one (eventually a new connection) in that case.
+                if not reused:
+                    REQUESTS.inc(label, "error")
+                    raise
+                logging.debug("Stale connection to %s:%d, reconnecting",
+                              self.server, self.port)
+                continue
+            except BaseException:
+                writer.close()
+                raise
+
+            try:
+                status, reason, data, will_close = \
+                    await read_response(reader)
+            except BaseException:
+                # Also on e.g. cancellation, as the rest of the response
+                # would be read by the next request
+                writer.close()
+                REQUESTS.inc(label, "error")
+                raise
+            break
+
+        if will_close:
+            writer.close()
+        else:
+            self._release(connection)
+        REQUESTS.inc(label, str(status))
+        REQUEST_SECONDS.observe(time.perf_counter() - start, label)
+
+        if status != http.OK:
+            raise RuntimeError(
+                "Could not get {} from {}:{}: {} {}".format(
+                    path, self.server, self.port, status, reason))
+        return data
+
+    async def _token(self, path, token=None, secret=None):
+        return _parse_token(await self._request(path, token, secret))
+
+    async def request_token(self):
+        """ Returns url, request_token, request_secret"""
+        logging.debug("Getting request token from %s:%d",
+                      self.server, self.port)
+        token, secret = await self._token("/oauth/requestToken")
+        return "{}/oauth/authorize?oauth_token={}".format(self.host, token), \
+            token, secret
+
+    async def access_token(self, request_token, request_secret):
+        """Returns access_token, access_secret"""
+        logging.debug("Getting access token from %s:%d",
+                      self.server, self.port)
+        self.token, self.secret = await self._token(
+            "/oauth/accessToken", request_token, request_secret)
+        return self.token, self.secret
+
+    async def request(self, method, params):
+        path = _json_path(method, params)
+        return _parse_values(
+            await self._request(path, self.token, self.secret))
@@ -0,0 +1,153 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+from .live import BACKGROUND, INTERACTIVE, CommandResult, DeviceCache, \
+    TokenBucket, _group_commands, _list_params
+
+import asyncio
+import time
+
+
+class AsyncRateLimiter(TokenBucket):
+    """TokenBucket for requests sent by asyncio tasks."""
+    async def acquire(self, priority=INTERACTIVE):
+        """Wait until a request with the given priority may be sent."""
+        self.waiting[priority] += 1
+        try:
+            while True:
+                wait = self.take(priority)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self.waiting[priority] -= 1
+
+
+class AsyncTelldusLive(DeviceCache):
+    """asyncio version of TelldusLive, to be used with AsyncLiveClient.
+
+    Attributes of the returned devices are never fetched implicitly, call
+    (and await) AsyncDevice.refresh() to update them.
+    """
+    def __init__(self, client, cache_ttl=60, rate_limit=10, clock=time.time):
+        super().__init__(cache_ttl, clock)
+        self._client = client
+        self.limiter = AsyncRateLimiter(rate_limit) if rate_limit else None
+
+    async def request(self, method, params, priority=INTERACTIVE):
+        if self.limiter:
+            await self.limiter.acquire(priority)
+        return await self._client.request(method, params)
+
+    async def devices(self, supported_methods=None):
+        await self.refresh_all(supported_methods)
+        return [AsyncDevice(self._client, id, params, live=self)
+                for id, params in self._cache.items()]
+
+    async def refresh_all(self, supported_methods=None):
+        """Refresh the cached state of all devices with one request."""
+        self._store_all(await self.request(
+            "devices/list", _list_params(supported_methods), BACKGROUND))
+
+    async def device_params(self, device_id):
+        """Return the cached state of a device, refreshed if stale."""
+        if self.expired():
+            await self.refresh_all()
+        elif self.stale(device_id):
+            await AsyncDevice(self._client, device_id, live=self).refresh()
+        return self._cache.get(device_id, {})
+
+    async def execute_many(self, commands, concurrency=8,
+                           priority=INTERACTIVE):
+        """Execute many device commands concurrently.
+
+        Same as TelldusLive.execute_many, but with up to concurrency
+        requests outstanding instead of using threads.
+        """
+        per_device = _group_commands(commands)
+        results = [None] * sum(len(c) for c in per_device.values())
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def execute(device_commands):
+            for index, method, params in device_commands:
+                try:
+                    async with semaphore:
+                        result = await self.request(
+                            "device/" + method, params, priority)
+                    error = None
+                except Exception as e:
+                    result, error = None, e
+                self.invalidate(params['id'])
+                results[index] = CommandResult(params['id'], method, result,
+                                               error)
+
+        await asyncio.gather(*[execute(c) for c in per_device.values()])
+        return results
+
+
+class AsyncDevice(object):
+    def __init__(self, client, id, params={}, live=None):
+        super().__init__()
+        self._client = client
+        self._live = live
+        self.id = id
+        self._update(params)
+
+    def _update(self, params):
+        for name in ['name', 'state', 'statevalue']:
+            if name in params:
+                setattr(self, name, params[name])
+
+    async def _request(self, method, params):
+        if self._live is not None:
+            return await self._live.request(method, params)
+        return await self._client.request(method, params)
+
+    async def _sync(self):
+        if self._live is not None:
+            self._update(await self._live.device_params(self.id))
+
+    async def refresh(self, supported_methods=None):
+        params = dict(_list_params(supported_methods), id=self.id)
+        values = await self._request("device/info", params)
+        self._update(values)
+        if self._live is not None:
+            self._live._store(self.id, values)
+
+    async def turn_on(self):
+        params = {'id': self.id}
+        await self._request("device/turnOn", params)
+        if self._live is not None:
+            self._live.invalidate(self.id)
+
+    async def turn_off(self):
+        params = {'id': self.id}
+        await self._request("device/turnOff", params)
+        if self._live is not None:
+            self._live.invalidate(self.id)
+
+    async def last_sent_command(self):
+        await self._sync()
+        if not hasattr(self, 'state'):
+            await self.refresh()
+        return self.state
+
+    async def last_sent_value(self):
+        await self._sync()
+        if not hasattr(self, 'statevalue'):
+            await self.refresh()
+        return self.statevalue
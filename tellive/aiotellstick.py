@@ -0,0 +1,180 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+from .livemessage import LiveMessageDecoder
+from .tellstick import BYTES_RECEIVED, TellstickLiveClient
+
+import asyncio
+import logging
+import time
+
+
+class AsyncTellstickLiveClient(TellstickLiveClient):
+    """asyncio version of TellstickLiveClient.
+
+    All methods that send something (register, ping, report_devices, ...)
+    return an awaitable that completes when the data has been handed to the
+    transport. Incoming messages are received by iterating over the client:
+
+        client = AsyncTellstickLiveClient(PUBLIC_KEY, PRIVATE_KEY)
+        await client.connect_to_first_available_server()
+        await client.register(version="0.1")
+        async for message in client:
+            ...
+    """
+    def __init__(self, public_key, private_key, ssl_context=None,
+                 journal=None):
+        super().__init__(public_key, private_key, ssl_context=ssl_context,
+                         journal=journal)
+        self.reader = None
+        self.writer = None
+        self.keepalive_task = None
+        self.error = None
+
+    async def connect(self, address, timeout=5):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(address[0], address[1],
+                                    ssl=self.ssl_context(),
+                                    server_hostname=address[0]),
+            timeout)
+        self.decoder = LiveMessageDecoder()
+        self.received.clear()
+        self.error = None
+        self.time_sent = time.time()
+        self.time_received = self.time_sent
+        self.keepalive_task = asyncio.ensure_future(self._keepalive())
+
+    async def connect_to_first_available_server(self, **kwargs):
+        loop = asyncio.get_event_loop()
+        servers = await loop.run_in_executor(None, self.cached_servers)
+        for server in servers:
+            try:
+                logging.debug("Connecting to %s:%d", server[0], server[1])
+                await self.connect(server, **kwargs)
+            except Exception:
+                continue
+            self.server_cache = [server] + \
+                [s for s in self.server_cache if s != server]
+            return server
+        self.server_cache_time = 0
+        raise RuntimeError("Could not connect to any available server")
+
+    async def disconnect(self):
+        self.journaling = self.journal is not None
+        if self.keepalive_task:
+            if self.keepalive_task is not asyncio.current_task():
+                self.keepalive_task.cancel()
+            self.keepalive_task = None
+        if self.writer:
+            writer = self.writer
+            self.reader = self.writer = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def send_message(self, message):
+        if self._journaled(message):
+            return
+        if not self.writer:
+            raise RuntimeError("Not connected")
+        data = self._serialize(message, bytearray())
+        logging.debug("Sending: %s", data)
+        self.writer.write(data)
+        self.time_sent = time.time()
+        await self.writer.drain()
+
+    async def replay_journal(self):
+        """Send the events in the journal and stop journaling, see
+        TellstickLiveClient.replay_journal()."""
+        messages = self._take_journal()
+        for message in messages:
+            await self.send_message(message)
+        return len(messages)
+
+    async def _send_report(self, message):
+        result = super()._send_report(message)
+        if result is not None:
+            await result
+
+    async def receive_messages(self):
+        """Wait for data from the server and return all complete messages
+        received so far.
+
+        An empty list is returned if more data is needed to complete a
+        message.
+        """
+        if not self.reader:
+            raise self.error or RuntimeError("Not connected")
+        data = await self.reader.read(self.RECEIVE_SIZE)
+        if not data:
+            if not self.reader and not self.error:
+                # Disconnected locally
+                return []
+            raise self.error or RuntimeError("Connection closed by server")
+
+        logging.debug("Received: %s", data)
+        self.time_received = time.time()
+        BYTES_RECEIVED.inc(amount=len(data))
+        self.decoder.feed(data)
+
+        self._decode_received()
+
+        messages = list(self.received)
+        self.received.clear()
+        return messages
+
+    async def receive_message(self):
+        """Wait until a message is received and return it."""
+        while not self.received:
+            self.received.extend(await self.receive_messages())
+        return self.received.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.received:
+            if not self.reader and not self.error:
+                raise StopAsyncIteration
+            self.received.extend(await self.receive_messages())
+        return self.received.popleft()
+
+    async def _keepalive(self):
+        """Ping the server when needed and disconnect if it goes silent."""
+        while self.writer:
+            now = time.time()
+
+            next_pong_time = self.PONG_INTERVAL - (now - self.time_received)
+            if next_pong_time <= 0:
+                logging.warning("No pong received from server")
+                self.error = RuntimeError("No pong received from server")
+                await self.disconnect()
+                break
+
+            next_ping_time = self.PING_INTERVAL - (now - self.time_sent)
+            if next_ping_time <= 5:
+                try:
+                    await self.ping()
+                except OSError as e:
+                    self.error = e
+                    await self.disconnect()
+                    break
+                next_ping_time = self.PING_INTERVAL
+
+            await asyncio.sleep(min(next_pong_time, next_ping_time))
@@ -15,18 +15,49 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
+from . import metrics
+
 import http.client as http
 import json
 import logging
 import oauthlib.oauth1
+import select
+import threading
+import time
 import urllib.parse
 
+REQUESTS = metrics.REGISTRY.counter(
+    "tellive_rest_requests_total", "Requests to the Telldus Live API",
+    ["path", "status"])
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "tellive_rest_request_seconds", "Time taken by Telldus Live API requests",
+    ["path"])
+
 class TelldusLiveError(Exception):
     def __init__(self, error):
         super().__init__(error)
 
 
+def _parse_token(data):
+    qs = urllib.parse.parse_qs(data.decode('utf-8'))
+    return qs['oauth_token'][0], qs['oauth_token_secret'][0]
+
+
+def _json_path(method, params):
+    return "/json/{}?{}".format(method, urllib.parse.urlencode(params))
+
+
+def _parse_values(data):
+    values = json.loads(data.decode('utf-8'))
+    if 'error' in values:
+        raise TelldusLiveError(values['error'])
+    return values
+
+
 class LiveClient(object):
+    # Max number of idle keep-alive connections to keep open
+    POOL_SIZE = 4
+
     def __init__(self, public_key, private_key, server='api.telldus.com',
                  port=http.HTTP_PORT, access_token=None, access_secret=None):
         super().__init__()
@@ -39,28 +70,100 @@ class LiveClient(object):
             self.host += ":{}".format(port)
         self.token = access_token
         self.secret = access_secret
+        self._lock = threading.Lock()
+        self._connections = []
+        self._signers = {}
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def _signer(self, token, secret):
+        with self._lock:
+            signer = self._signers.get((token, secret))
+            if signer is None:
+                signer = oauthlib.oauth1.Client(
+                    self.public_key, client_secret=self.private_key,
+                    resource_owner_key=token, resource_owner_secret=secret)
+                self._signers[(token, secret)] = signer
+            return signer
+
+    def _connection(self):
+        """Return (connection, reused) with an idle connection if any."""
+        with self._lock:
+            while self._connections:
+                conn = self._connections.pop()
+                # An idle connection is readable if the server closed it
+                if conn.sock is not None \
+                   and not select.select([conn.sock], [], [], 0)[0]:
+                    return conn, True
+                logging.debug("Idle connection to %s:%d closed by server",
+                              self.server, self.port)
+                conn.close()
+        return http.HTTPConnection(self.server, self.port), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._connections) < self.POOL_SIZE:
+                self._connections.append(conn)
+                return
+        conn.close()
 
     def _request(self, path, token, secret):
-        client = oauthlib.oauth1.Client(
-            self.public_key, client_secret=self.private_key,
-            resource_owner_key=token, resource_owner_secret=secret)
+        """Send a signed request and return the response body.
+
+        The request is only sent again if it could not be written to a
+        reused connection, as it may e.g. turn on a device.
+        """
+        label = path.split('?')[0]
+        start = time.perf_counter()
+
+        while True:
+            # Signed for each attempt, as the nonce must not be reused
+            uri, headers, body = self._signer(token, secret).sign(
+                self.host + path)
+            conn, reused = self._connection()
+            try:
+                conn.request('GET', path, body=body, headers=headers)
+            except (http.HTTPException, OSError):
+                conn.close()
+                # The server may have closed an idle connection, retry with
+                # another one (eventually a new connection) in that case.
+                if not reused:
+                    REQUESTS.inc(label, "error")
+                    raise
+                logging.debug("Stale connection to %s:%d, reconnecting",
+                              self.server, self.port)
+                continue
+
+            try:
+                response = conn.getresponse()
+                data = response.read()
+            except (http.HTTPException, OSError):
+                conn.close()
+                REQUESTS.inc(label, "error")
+                raise
+            break
 
-        uri, headers, body = client.sign(self.host + path)
-        conn = http.HTTPConnection(self.server, self.port)
-        conn.request('GET', path, body=body, headers=headers)
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        REQUESTS.inc(label, str(response.status))
+        REQUEST_SECONDS.observe(time.perf_counter() - start, label)
 
-        response = conn.getresponse()
         if response.status != http.OK:
             raise RuntimeError(
                 "Could not get {} from {}:{}: {} {}".format(
                     path, self.server, self.port, response.status,
                     response.reason))
-        return response
+        return data
 
     def _token(self, path, token=None, secret=None):
-        response = self._request(path, token, secret)
-        qs = urllib.parse.parse_qs(response.read().decode('utf-8'))
-        return qs['oauth_token'][0], qs['oauth_token_secret'][0]
+        return _parse_token(self._request(path, token, secret))
 
     def request_token(self):
         """ Returns url, request_token, request_secret"""
@@ -79,9 +182,5 @@ class LiveClient(object):
         return self.access_token, self.access_secret
 
     def request(self, method, params):
-        path = "/json/{}?{}".format(method, urllib.parse.urlencode(params))
-        response = self._request(path, self.token, self.secret)
-        values = json.loads(response.read().decode('utf-8'))
-        if 'error' in values:
-            raise TelldusLiveError(values['error'])
-        return values
+        path = _json_path(method, params)
+        return _parse_values(self._request(path, self.token, self.secret))
@@ -0,0 +1,192 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import collections
+import logging
+import time
+
+
+class SensorEventCoalescer(object):
+    """Collects sensor values and reports them in batches.
+
+    Values for the same sensor that arrive within window seconds of the
+    first one are sent in a single SensorEvent. A value identical to the
+    last one sent for the same sensor and datatype is dropped, unless it
+    was sent more than refresh_interval seconds ago.
+
+    flush() must be called when timeout() has passed, e.g. by using it as
+    the timeout for select.
+    """
+    def __init__(self, client, window=2, refresh_interval=10 * 60):
+        super().__init__()
+        self.client = client
+        self.window = window
+        self.refresh_interval = refresh_interval
+        # (protocol, model, id) -> (flush time, {datatype: (value, ts)})
+        self.pending = {}
+        # (protocol, model, id, datatype) -> (value, time sent)
+        self.sent = {}
+
+    def add(self, protocol, model, sensor_id, datatype, value, timestamp,
+            now=None):
+        if now is None:
+            now = time.time()
+        key = (protocol, model, sensor_id)
+        if key not in self.pending:
+            self.pending[key] = (now + self.window, {})
+        self.pending[key][1][datatype] = (value, timestamp)
+
+    def timeout(self, now=None):
+        """Return seconds until flush() needs to be called, or None."""
+        if not self.pending:
+            return None
+        if now is None:
+            now = time.time()
+        first = min(flush_time for flush_time, _ in self.pending.values())
+        return max(0, first - now)
+
+    def flush(self, now=None, force=False):
+        """Report the sensors whose window has passed (or all if force).
+
+        :return: number of SensorEvent messages sent
+        """
+        if now is None:
+            now = time.time()
+        due = [key for key, (flush_time, _) in self.pending.items()
+               if force or flush_time <= now]
+
+        sent = 0
+        for key in due:
+            _, values = self.pending.pop(key)
+            changed = []
+            for datatype, (value, timestamp) in sorted(values.items()):
+                last = self.sent.get(key + (datatype,))
+                if last and last[0] == value \
+                   and now - last[1] < self.refresh_interval:
+                    continue
+                changed.append((datatype, value, timestamp))
+
+            if not changed:
+                logging.debug("Dropping unchanged values for sensor %s", key)
+                continue
+
+            self.client.report_sensor_event(key[0], key[1], key[2], changed)
+            for datatype, value, _ in changed:
+                self.sent[key + (datatype,)] = (value, now)
+            sent += 1
+        return sent
+
+
+class DeviceReportDebouncer(object):
+    """Keeps the devices reported to Live up to date after changes.
+
+    Device change events are collected for delay seconds and then handled
+    with a single DevicesReport. Only the changed devices are queried again
+    and nothing is sent if the resulting list is the same as the last one
+    reported.
+
+    :param device_factory: function returning the device with a given id,
+        or None if it should not be reported
+    """
+    def __init__(self, client, device_factory, delay=1):
+        super().__init__()
+        self.client = client
+        self.device_factory = device_factory
+        self.delay = delay
+        self.supported_methods = 0
+        # id -> values, as returned by client.device_values()
+        self.devices = collections.OrderedDict()
+        self.reported = None
+        # id -> True if removed
+        self.dirty = {}
+        self.flush_time = None
+
+    def report(self, devices, supported_methods):
+        """Report all devices, e.g. when the client has registered."""
+        self.supported_methods = supported_methods
+        self.devices = collections.OrderedDict(
+            (device.id, self.client.device_values(device, supported_methods))
+            for device in devices)
+        self.dirty.clear()
+        self.flush_time = None
+        self.reported = None
+        self._send()
+
+    def changed(self, device_id, removed=False, now=None):
+        if now is None:
+            now = time.time()
+        self.dirty[device_id] = removed or self.dirty.get(device_id, False)
+        if self.flush_time is None:
+            self.flush_time = now + self.delay
+
+    def event(self, device_id, method, data):
+        """Update the state of a device after a DeviceEvent, so that a later
+        DevicesReport does not undo it."""
+        values = self.devices.get(device_id)
+        if values is None:
+            return
+        self.devices[device_id] = dict(
+            values, state=method, stateValue=str('' if data is None else data))
+
+    def timeout(self, now=None):
+        """Return seconds until flush() needs to be called, or None."""
+        if self.flush_time is None:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0, self.flush_time - now)
+
+    def flush(self, now=None, force=False):
+        """Report the changed devices if the delay has passed.
+
+        :return: True if a DevicesReport was sent
+        """
+        if self.flush_time is None:
+            return False
+        if now is None:
+            now = time.time()
+        if not force and now < self.flush_time:
+            return False
+
+        dirty, self.dirty = self.dirty, {}
+        self.flush_time = None
+        if self.reported is None:
+            # Nothing reported yet, report() will include all devices
+            return False
+        for device_id, removed in dirty.items():
+            device = None
+            if not removed:
+                try:
+                    device = self.device_factory(device_id)
+                except Exception as e:
+                    logging.debug("Could not query device %d: %s",
+                                  device_id, e)
+            if device is None:
+                self.devices.pop(device_id, None)
+            else:
+                self.devices[device_id] = self.client.device_values(
+                    device, self.supported_methods)
+        return self._send()
+
+    def _send(self):
+        dev_list = list(self.devices.values())
+        if dev_list == self.reported:
+            logging.debug("Devices unchanged, not reporting")
+            return False
+        self.client.report_device_list(dev_list)
+        self.reported = dev_list
+        return True
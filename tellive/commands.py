@@ -0,0 +1,150 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+from . import metrics
+
+import collections
+import logging
+import threading
+import time
+
+COMMAND_SECONDS = metrics.REGISTRY.histogram(
+    "tellive_command_seconds",
+    "Time from a command being received until the device has been actuated",
+    ["action"])
+COMMANDS_COLLAPSED = metrics.REGISTRY.counter(
+    "tellive_commands_collapsed_total",
+    "Commands dropped since a later command for the same device replaced them",
+    ["action"])
+
+# Commands in the same group replace each other, e.g. a dim to 50% that
+# has not been sent yet is pointless once a turn off has been received.
+# stop is not in the motion group, as "up, stop" is how a blind is moved
+# part of the way.
+SUPERSEDES = {
+    "turnon": "state",
+    "turnoff": "state",
+    "dim": "state",
+    "up": "motion",
+    "down": "motion",
+}
+
+
+class CommandQueue(object):
+    """Executes device commands in worker threads.
+
+    Each device has its own queue and its commands are executed in the
+    order received, while commands for different devices may run in
+    parallel if workers > 1. A queued command that is directly followed
+    by one in the same SUPERSEDES group for the same device is dropped,
+    so only e.g. the latest dim level is sent.
+
+    :param execute: function(device_id, action, value) called in a worker
+        thread for each command
+    """
+    def __init__(self, execute, workers=1):
+        super().__init__()
+        self.execute = execute
+        self.condition = threading.Condition()
+        # device id -> deque of (action, value, time received)
+        self.pending = {}
+        # Device ids with pending commands and no command being executed
+        self.ready = collections.deque()
+        self.running = set()
+        self.closed = False
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name="CommandQueue-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(q) for q in self.pending.values())
+
+    def submit(self, device_id, action, value=None, received=None):
+        """Queue a command and return immediately.
+
+        :param received: time.perf_counter() when the command was received,
+            defaults to now
+        """
+        if received is None:
+            received = time.perf_counter()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("CommandQueue is closed")
+            queue = self.pending.get(device_id)
+            if queue is None:
+                queue = self.pending[device_id] = collections.deque()
+                if device_id not in self.running:
+                    self.ready.append(device_id)
+                    self.condition.notify()
+            group = SUPERSEDES.get(action)
+            while queue and group is not None \
+                    and SUPERSEDES.get(queue[-1][0]) == group:
+                dropped = queue.pop()
+                logging.debug("Command %s for device %s replaced by %s",
+                              dropped[0], device_id, action)
+                COMMANDS_COLLAPSED.inc(dropped[0])
+            queue.append((action, value, received))
+
+    def close(self, timeout=None):
+        """Execute the queued commands and stop the workers."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _next(self):
+        with self.condition:
+            while not self.ready:
+                if self.closed:
+                    return None, None
+                self.condition.wait()
+            device_id = self.ready.popleft()
+            queue = self.pending[device_id]
+            command = queue.popleft()
+            if not queue:
+                del self.pending[device_id]
+            self.running.add(device_id)
+            return device_id, command
+
+    def _done(self, device_id):
+        with self.condition:
+            self.running.discard(device_id)
+            if device_id in self.pending:
+                self.ready.append(device_id)
+                self.condition.notify()
+
+    def _work(self):
+        while True:
+            device_id, command = self._next()
+            if device_id is None:
+                return
+            action, value, received = command
+            try:
+                self.execute(device_id, action, value)
+                COMMAND_SECONDS.observe(time.perf_counter() - received,
+                                        action)
+            except Exception as e:
+                logging.error("Command %s for device %s failed: %s",
+                              action, device_id, e)
+            finally:
+                self._done(device_id)
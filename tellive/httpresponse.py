@@ -0,0 +1,98 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import http.client as http
+
+
+class MalformedResponse(http.HTTPException):
+    pass
+
+
+def _parse_int(data, base, what):
+    try:
+        value = int(data, base)
+    except ValueError:
+        raise MalformedResponse("Invalid {}: {!r}".format(what, data)) \
+            from None
+    if value < 0:
+        raise MalformedResponse("Invalid {}: {!r}".format(what, data))
+    return value
+
+
+async def _readline(reader):
+    try:
+        return await reader.readline()
+    except ValueError:
+        # The line is longer than the limit of the reader
+        raise MalformedResponse("Line too long") from None
+
+
+async def read_response(reader):
+    """Read an HTTP/1.1 response from an asyncio.StreamReader.
+
+    A malformed response raises MalformedResponse (an HTTPException) and
+    a connection closed too early raises ConnectionError or
+    asyncio.IncompleteReadError. In both cases the connection must be
+    closed.
+
+    :return: (status, reason, body, will_close)
+    """
+    line = await _readline(reader)
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise http.BadStatusLine(line)
+    version = parts[0]
+    status = _parse_int(parts[1], 10, "status")
+    reason = parts[2] if len(parts) > 2 else ""
+
+    headers = {}
+    while True:
+        line = await _readline(reader)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    will_close = version == "HTTP/1.0" \
+        or headers.get('connection', '').lower() == "close"
+
+    if headers.get('transfer-encoding', '').lower() == "chunked":
+        body = bytearray()
+        while True:
+            line = await _readline(reader)
+            if not line:
+                raise ConnectionError("Connection closed by server")
+            size = _parse_int(line.split(b';')[0].strip(), 16, "chunk size")
+            if size == 0:
+                # Skip any trailers
+                while (await _readline(reader)) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            if (await reader.readexactly(2)) != b'\r\n':
+                raise MalformedResponse("Missing CRLF after chunk")
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(
+            _parse_int(headers['content-length'], 10, "Content-Length"))
+    else:
+        body = await reader.read()
+        will_close = True
+
+    return status, reason, body, will_close
@@ -0,0 +1,133 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import logging
+import mmap
+import os
+import struct
+
+# magic, offset of the oldest record, offset after the newest record
+_HEADER = struct.Struct('<4sQQ')
+_MAGIC = b'TLJ1'
+_DATA = 32
+# Record length, a length of 0 means that the next record is at _DATA
+_LENGTH = struct.Struct('<I')
+
+
+class Journal(object):
+    """Bounded append-only journal of records in a memory-mapped ring file.
+
+    Records are appended after the newest one and the oldest records are
+    dropped when the file is full. Only the appended record and the header
+    are written, and the records are kept when the file is opened again.
+    """
+    def __init__(self, path, size=1024 * 1024):
+        super().__init__()
+        self.path = path
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists or os.path.getsize(path) < _DATA + _LENGTH.size:
+            self.file.truncate(max(size, _DATA + _LENGTH.size))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.size = len(self.map)
+
+        magic, self.head, self.tail = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC or not (_DATA <= self.head <= self.size) \
+           or not (_DATA <= self.tail <= self.size):
+            if exists:
+                logging.warning("Invalid journal %s, starting a new one",
+                                path)
+            self.clear()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return sum(1 for _ in self.records())
+
+    def _write_header(self):
+        if self.head == self.tail:
+            self.head = self.tail = _DATA
+        _HEADER.pack_into(self.map, 0, _MAGIC, self.head, self.tail)
+
+    def _drop_oldest(self):
+        if self.size - self.head < _LENGTH.size:
+            self.head = _DATA
+            return
+        length, = _LENGTH.unpack_from(self.map, self.head)
+        if length == 0:
+            self.head = _DATA
+        else:
+            self.head += _LENGTH.size + length
+            if self.head == self.tail:
+                self.head = self.tail = _DATA
+
+    def append(self, data):
+        """Append a record (bytes), dropping the oldest ones if needed."""
+        need = _LENGTH.size + len(data)
+        if not data or need >= self.size - _DATA:
+            raise ValueError("Invalid record size {}".format(len(data)))
+
+        dropped = 0
+        while True:
+            if self.tail >= self.head:
+                if self.size - self.tail >= need:
+                    break
+                if self.head == self.tail:
+                    self.head = self.tail = _DATA
+                    continue
+                if _DATA + need < self.head:
+                    # Wrap around to the start of the data area
+                    if self.size - self.tail >= _LENGTH.size:
+                        _LENGTH.pack_into(self.map, self.tail, 0)
+                    self.tail = _DATA
+                    continue
+            elif self.tail + need < self.head:
+                break
+            self._drop_oldest()
+            dropped += 1
+
+        if dropped:
+            logging.debug("Journal full, dropped %d records", dropped)
+        _LENGTH.pack_into(self.map, self.tail, len(data))
+        start = self.tail + _LENGTH.size
+        self.map[start:start + len(data)] = data
+        self.tail += need
+        self._write_header()
+
+    def records(self):
+        """Yield all records (bytes), oldest first."""
+        offset = self.head
+        while offset != self.tail:
+            if self.size - offset < _LENGTH.size:
+                offset = _DATA
+                continue
+            length, = _LENGTH.unpack_from(self.map, offset)
+            if length == 0:
+                offset = _DATA
+                continue
+            start = offset + _LENGTH.size
+            yield self.map[start:start + length]
+            offset = start + length
+
+    def clear(self):
+        """Remove all records."""
+        self.head = self.tail = _DATA
+        self._write_header()
+        self.map.flush()
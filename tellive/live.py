@@ -17,33 +17,390 @@
 
 import tellcore.constants as const
 
-class TelldusLive(object):
-    def __init__(self, client):
+import array
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import weakref
+
+ALL_METHODS = const.TELLSTICK_TURNON \
+    | const.TELLSTICK_TURNOFF \
+    | const.TELLSTICK_BELL \
+    | const.TELLSTICK_TOGGLE \
+    | const.TELLSTICK_DIM \
+    | const.TELLSTICK_LEARN \
+    | const.TELLSTICK_EXECUTE \
+    | const.TELLSTICK_UP \
+    | const.TELLSTICK_DOWN \
+    | const.TELLSTICK_STOP
+
+# Request priorities, lower is more important
+INTERACTIVE = 0
+BACKGROUND = 1
+
+CommandResult = collections.namedtuple(
+    'CommandResult', ['device_id', 'method', 'result', 'error'])
+
+# Seconds of sensor history fetched per request
+HISTORY_PAGE = 30 * 24 * 60 * 60
+
+
+class TokenBucket(object):
+    """Token bucket allowing rate requests per second, in bursts of up to
+    burst requests.
+
+    When requests are waiting for a token, the ones with the lowest
+    priority value are let through first. Only the bookkeeping is done
+    here, RateLimiter and AsyncRateLimiter do the waiting.
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+        # priority -> number of requests waiting for a token
+        self.waiting = collections.Counter()
+
+    def take(self, priority=INTERACTIVE):
+        """Take a token for a request with the given priority.
+
+        :return: 0 if a token was taken, otherwise seconds to wait before
+            trying again
+        """
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        first = min((p for p, n in self.waiting.items() if n),
+                    default=priority)
+        if self.tokens >= 1 and priority <= first:
+            self.tokens -= 1
+            return 0
+        return max(0.001, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter(TokenBucket):
+    """TokenBucket for requests sent by threads."""
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        super().__init__(rate, burst, clock)
+        self.condition = threading.Condition()
+
+    def acquire(self, priority=INTERACTIVE):
+        """Block until a request with the given priority may be sent."""
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    wait = self.take(priority)
+                    if not wait:
+                        return
+                    self.condition.wait(wait)
+            finally:
+                self.waiting[priority] -= 1
+                self.condition.notify_all()
+
+
+def _list_params(supported_methods=None):
+    """Return the parameters of devices/list and device/info."""
+    if supported_methods is None:
+        supported_methods = ALL_METHODS
+    return {'supportedMethods': supported_methods,
+            'extras': 'coordinate,timezone,tzoffset'}
+
+
+def _group_commands(commands):
+    """Group the commands given to execute_many() per device.
+
+    :return: OrderedDict of device id -> list of (index, method, params)
+    """
+    per_device = collections.OrderedDict()
+    for index, command in enumerate(commands):
+        device_id, method = command[:2]
+        params = {'id': device_id}
+        if len(command) > 2:
+            params.update(command[2])
+        per_device.setdefault(device_id, []).append((index, method, params))
+    return per_device
+
+
+class DeviceCache(object):
+    """The cached state of all devices, shared by TelldusLive and
+    AsyncTelldusLive which do the requests.
+
+    :param clock: function returning the current time in seconds
+    """
+    def __init__(self, cache_ttl=60, clock=time.time):
         super().__init__()
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self._cache = {}
+        self._cache_time = None
+        self._invalid = set()
+
+    def _store_all(self, values):
+        """Replace the cache with the result of devices/list."""
+        self._cache = {p['id']: p for p in values['device']}
+        self._cache_time = self.clock()
+        self._invalid.clear()
+
+    def _store(self, device_id, params):
+        self._cache[device_id] = params
+        self._invalid.discard(device_id)
+
+    def invalidate(self, device_id=None):
+        """Mark the cached state of a device (or all) as stale."""
+        if device_id is None:
+            self._cache_time = None
+        else:
+            self._invalid.add(device_id)
+
+    def expired(self):
+        """Return True if all devices need to be refreshed."""
+        return self._cache_time is None \
+            or self.clock() - self._cache_time > self.cache_ttl
+
+    def stale(self, device_id):
+        """Return True if only the given device needs to be refreshed."""
+        return device_id in self._invalid
+
+
+class TelldusLive(DeviceCache):
+    """Access to the devices of a Telldus Live account.
+
+    The state of all devices is cached for cache_ttl seconds. The cache is
+    filled with a single devices/list request and shared by all Device
+    objects returned by devices().
+
+    Requests are limited to rate_limit per second (None for no limit), with
+    device commands let through before background refreshes.
+    """
+    def __init__(self, client, cache_ttl=60, rate_limit=10, clock=time.time):
+        super().__init__(cache_ttl, clock)
         self._client = client
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._watchers = weakref.WeakSet()
+
+    def request(self, method, params, priority=INTERACTIVE):
+        if self.limiter:
+            self.limiter.acquire(priority)
+        return self._client.request(method, params)
 
     def devices(self, supported_methods=None):
-        if supported_methods is None:
-            supported_methods = const.TELLSTICK_TURNON \
-                | const.TELLSTICK_TURNOFF \
-                | const.TELLSTICK_BELL \
-                | const.TELLSTICK_TOGGLE \
-                | const.TELLSTICK_DIM \
-                | const.TELLSTICK_LEARN \
-                | const.TELLSTICK_EXECUTE \
-                | const.TELLSTICK_UP \
-                | const.TELLSTICK_DOWN \
-                | const.TELLSTICK_STOP
-        params = {'supportedMethods': supported_methods,
-                  'extras': 'coordinate,timezone,tzoffset'}
-        values = self._client.request("devices/list", params)
-        return [Device(self._client, p['id'], p) for p in values['device']]
+        self.refresh_all(supported_methods)
+        return [Device(self._client, id, params, live=self)
+                for id, params in self._cache.items()]
+
+    def refresh_all(self, supported_methods=None):
+        """Refresh the cached state of all devices with one request."""
+        self._store_all(self.request(
+            "devices/list", _list_params(supported_methods), BACKGROUND))
+
+    def invalidate(self, device_id=None):
+        super().invalidate(device_id)
+        # The state is likely to change, e.g. after a command
+        for watcher in list(self._watchers):
+            watcher.kick()
+
+    def watch(self, callback=None, **kwargs):
+        """Watch all devices for changes, see DeviceWatcher.
+
+        If callback is given, it is called with each changed Device from a
+        background thread. Otherwise iterate over the returned watcher to
+        get the changed devices.
+
+        :return: DeviceWatcher, call stop() on it when done
+        """
+        watcher = DeviceWatcher(self, **kwargs)
+        self._watchers.add(watcher)
+        if callback is not None:
+            thread = threading.Thread(target=watcher.run, args=(callback,),
+                                      daemon=True)
+            thread.start()
+        return watcher
+
+    def execute_many(self, commands, workers=8, priority=INTERACTIVE):
+        """Execute many device commands concurrently.
+
+        Commands for different devices are sent in parallel by up to
+        workers threads, while the commands for each device are sent in the
+        given order.
+
+        :param commands: list of (device_id, method) or (device_id, method,
+            params) where method is e.g. "turnOn" or "dim" and params is a
+            dict of extra parameters (e.g. {'level': 128})
+
+        :return: list of CommandResult in the same order as commands, with
+            either result or error set
+        """
+        per_device = _group_commands(commands)
+        results = [None] * sum(len(c) for c in per_device.values())
+
+        def execute(device_commands):
+            for index, method, params in device_commands:
+                try:
+                    result = self.request("device/" + method, params,
+                                          priority)
+                    error = None
+                except Exception as e:
+                    result, error = None, e
+                self.invalidate(params['id'])
+                results[index] = CommandResult(params['id'], method, result,
+                                               error)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for future in [executor.submit(execute, c)
+                           for c in per_device.values()]:
+                future.result()
+        return results
+
+    def sensors(self, include_ignored=False):
+        """Return all sensors, with their latest values."""
+        params = {'includeValues': 1,
+                  'includeIgnored': 1 if include_ignored else 0}
+        values = self.request("sensors/list", params, BACKGROUND)
+        return [Sensor(self, p['id'], p) for p in values['sensor']]
+
+    def sensor_history_pages(self, sensor_id, start, end=None,
+                             page=HISTORY_PAGE, priority=BACKGROUND):
+        """Yield the history entries of a sensor one page at a time.
+
+        The range from start to end (seconds since the epoch, end defaults
+        to now) is fetched with one request per page seconds, so that only
+        one page at a time has to be decoded and kept in memory.
+        """
+        if end is None:
+            end = int(time.time())
+        while start <= end:
+            stop = min(end, start + page - 1)
+            params = {'id': sensor_id, 'from': start, 'to': stop}
+            values = self.request("sensor/history", params, priority)
+            yield values.get('history', [])
+            start = stop + 1
+
+    def sensor_history(self, sensor_id, start, end=None, page=HISTORY_PAGE,
+                       priority=BACKGROUND):
+        """Fetch the history of a sensor.
+
+        :return: SensorHistory
+        """
+        history = SensorHistory(sensor_id)
+        for entries in self.sensor_history_pages(sensor_id, start, end, page,
+                                                 priority):
+            history.extend(entries)
+        return history
+
+    def sensors_history(self, sensor_ids, start, end=None, workers=8,
+                        page=HISTORY_PAGE):
+        """Fetch the history of many sensors concurrently.
+
+        :return: dict of sensor id -> SensorHistory
+        """
+        if end is None:
+            end = int(time.time())
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [(sensor_id, executor.submit(
+                self.sensor_history, sensor_id, start, end, page))
+                for sensor_id in sensor_ids]
+            return {sensor_id: future.result()
+                    for sensor_id, future in futures}
+
+    def device_params(self, device_id):
+        """Return the cached state of a device, refreshed if stale."""
+        if self.expired():
+            self.refresh_all()
+        elif self.stale(device_id):
+            Device(self._client, device_id, live=self).refresh()
+        return self._cache.get(device_id, {})
+
+
+class DeviceWatcher(object):
+    """Polls the state of all devices and reports the ones that changed.
+
+    The first poll reports all devices. Polls are min_interval seconds
+    apart after a change or a command (see kick()), and the interval grows
+    by backoff after each poll without changes, up to max_interval.
+    """
+    def __init__(self, live, min_interval=2, max_interval=60, backoff=2,
+                 supported_methods=None):
+        super().__init__()
+        self.live = live
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.supported_methods = supported_methods
+        self.interval = min_interval
+        self.stopped = False
+        self._snapshot = None
+        self._wakeup = threading.Event()
+
+    def kick(self):
+        """Poll again soon."""
+        self.interval = self.min_interval
+        self._wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.live._watchers.discard(self)
+        self._wakeup.set()
+
+    def poll(self):
+        """Poll once.
+
+        :return: list of Device that are new or changed since the last poll
+        """
+        live = self.live
+        live.refresh_all(self.supported_methods)
+        snapshot = dict(live._cache)
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is None:
+            previous = {}
+
+        changed = [Device(live._client, id, params, live=live)
+                   for id, params in snapshot.items()
+                   if previous.get(id) != params]
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval,
+                                self.interval * self.backoff)
+        return changed
+
+    def wait(self):
+        """Wait until it is time for the next poll."""
+        self._wakeup.wait(self.interval)
+        self._wakeup.clear()
+
+    def __iter__(self):
+        while not self.stopped:
+            for device in self.poll():
+                yield device
+            self.wait()
+
+    def run(self, callback):
+        """Call callback with each changed device until stopped."""
+        while not self.stopped:
+            try:
+                changed = self.poll()
+            except Exception as e:
+                logging.warning("Polling devices failed: %s", e)
+                changed = []
+                self.interval = self.max_interval
+            for device in changed:
+                if self.stopped:
+                    break
+                callback(device)
+            self.wait()
 
 
 class Device(object):
-    def __init__(self, client, id, params={}):
+    def __init__(self, client, id, params={}, live=None):
         super().__init__()
         super().__setattr__('_client', client)
+        super().__setattr__('_live', live)
         super().__setattr__('id', id)
         self._update(params)
 
@@ -52,43 +409,113 @@ class Device(object):
             if name in params:
                 super().__setattr__(name, params[name])
 
+    def _request(self, method, params):
+        if self._live is not None:
+            return self._live.request(method, params)
+        return self._client.request(method, params)
+
+    def _sync(self):
+        if self._live is not None:
+            self._update(self._live.device_params(self.id))
+
     def __getattr__(self, name):
-        for attempt in range(2):
-            try:
+        # Try the shared cache before asking for the device info
+        if self._live is not None:
+            self._sync()
+            if name in self.__dict__:
                 return self.__dict__[name]
-            except KeyError:
-                if attempt == 0:
-                    self.refresh()
-                    continue
-                raise AttributeError(name) from None
+        self.refresh()
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
     def refresh(self, supported_methods=None):
-        if supported_methods is None:
-            supported_methods = const.TELLSTICK_TURNON \
-                | const.TELLSTICK_TURNOFF \
-                | const.TELLSTICK_BELL \
-                | const.TELLSTICK_TOGGLE \
-                | const.TELLSTICK_DIM \
-                | const.TELLSTICK_LEARN \
-                | const.TELLSTICK_EXECUTE \
-                | const.TELLSTICK_UP \
-                | const.TELLSTICK_DOWN \
-                | const.TELLSTICK_STOP
-        params = {'id': self.id, 'supportedMethods': supported_methods,
-                  'extras': 'coordinate,timezone,tzoffset'}
-        values = self._client.request("device/info", params)
+        params = dict(_list_params(supported_methods), id=self.id)
+        values = self._request("device/info", params)
         self._update(values)
+        if self._live is not None:
+            self._live._store(self.id, values)
 
     def turn_on(self):
         params = {'id': self.id}
-        self._client.request("device/turnOn", params)
+        self._request("device/turnOn", params)
+        if self._live is not None:
+            self._live.invalidate(self.id)
 
     def turn_off(self):
         params = {'id': self.id}
-        self._client.request("device/turnOff", params)
+        self._request("device/turnOff", params)
+        if self._live is not None:
+            self._live.invalidate(self.id)
 
     def last_sent_command(self):
+        self._sync()
         return self.state
 
     def last_sent_value(self):
+        self._sync()
         return self.statevalue
+
+
+class Sensor(object):
+    """A sensor as returned by TelldusLive.sensors()."""
+    def __init__(self, live, id, params={}):
+        super().__init__()
+        self._live = live
+        self.id = id
+        self.name = params.get('name')
+        self.protocol = params.get('protocol')
+        self.model = params.get('model')
+        self.last_updated = params.get('lastUpdated')
+        self.data = params.get('data', [])
+
+    def values(self):
+        """Return the latest values as a dict of (name, scale) -> value."""
+        return {(d['name'], int(d.get('scale', 0))): float(d['value'])
+                for d in self.data}
+
+    def history(self, start, end=None, page=HISTORY_PAGE):
+        """Fetch the history of the sensor, see
+        TelldusLive.sensor_history()."""
+        return self._live.sensor_history(self.id, start, end, page)
+
+
+class SensorHistory(object):
+    """Readings of a sensor, stored as columns.
+
+    The time of each history entry is kept in timestamps and the values of
+    each data type in values[(name, scale)], both as array.array. All
+    columns are as long as timestamps, with NaN where an entry lacks a
+    value of that type.
+    """
+    def __init__(self, sensor_id):
+        super().__init__()
+        self.sensor_id = sensor_id
+        self.timestamps = array.array('q')
+        self.values = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def extend(self, entries):
+        """Append history entries as returned by sensor/history."""
+        timestamps = self.timestamps
+        values = self.values
+        for entry in entries:
+            timestamps.append(int(entry['ts']))
+            length = len(timestamps)
+            for data in entry['data']:
+                key = (data['name'], int(data.get('scale', 0)))
+                column = values.get(key)
+                if column is None:
+                    column = values[key] = \
+                        array.array('d', [float('nan')]) * (length - 1)
+                column.append(float(data['value']))
+            for column in values.values():
+                if len(column) < length:
+                    column.append(float('nan'))
+
+    def series(self, name, scale=0):
+        """Return (timestamps, values) of one data type, e.g. "temp"."""
+        return self.timestamps, self.values[(name, scale)]
@@ -30,83 +30,99 @@ class LiveMessageToken(object):
 
     def serialize(self):
         """Serialize the token and return it as bytes."""
-        if type(self.value) == int:
-            return "i{:X}s".format(self.value).encode('ascii')
+        buffer = bytearray()
+        _encode(self.value, buffer)
+        return bytes(buffer)
 
-        if type(self.value) == str:
-            value = self.value.encode('utf-8')
-            return "{:X}:".format(len(value)).encode('ascii') + value
+    @staticmethod
+    def deserialize(data):
+        """Deserialize the first token in data.
 
-        if type(self.value) == bytes:
-            value = base64.standard_b64encode(self.value)
-            return "u{:X}:".format(len(value)).encode('ascii') + value
+        :return: (token, rest) or (None, None) if data is invalid
+        """
+        try:
+            value, end = _decode(data, 0, len(data))
+        except (ValueError, RuntimeError):
+            return (None, None)
+        return (LiveMessageToken(value), data[end:])
 
-        if type(self.value) == list:
-            items = [LiveMessageToken(m).serialize() for m in self.value]
-            return b'l' + b''.join(items) + b's'
 
-        if type(self.value) == dict:
-            items = []
-            for key, value in self.value.items():
-                items.append(LiveMessageToken(str(key)).serialize())
-                items.append(LiveMessageToken(value).serialize())
-            return b'h' + b''.join(items) + b's'
+class _Incomplete(ValueError):
+    """Raised when the data ends before the token does."""
 
-        raise RuntimeError("Unknown type %s" % type(self.value))
 
-    @staticmethod
-    def deserialize(data):
-        def _find(data, needle):
-            needle = ord(needle)
-            index = 0
-            while index < len(data):
-                if data[index] == needle:
-                    return index
-                index += 1
-            raise ValueError
-
-        def deserialize_int(data):
-            end = _find(data, 's')
-            return (LiveMessageToken(int(data[:end], 16)), data[end + 1:])
-
-        def deserialize_list(data):
-            result = []
-            while data[0] != ord('s'):
-                token, data = LiveMessageToken.deserialize(data)
-                result.append(token.value)
-            return (LiveMessageToken(result), data[1:])
-
-        def deserialize_dict(data):
-            result = {}
-            while data[0] != ord('s'):
-                key, data = LiveMessageToken.deserialize(data)
-                value, data = LiveMessageToken.deserialize(data)
-                result[str(key.value)] = value.value
-            return (LiveMessageToken(result), data[1:])
-
-        def deserialize_string(data, is_base64=False):
-            end = _find(data, ':')
-            value_end = end + 1 + int(data[:end], 16)
-            value = data[end + 1:value_end]
-            if is_base64:
-                value = base64.standard_b64decode(value)
-            else:
-                value = value.decode('utf-8')
-            return (LiveMessageToken(value), data[value_end:])
+_INT = ord('i')
+_LIST = ord('l')
+_DICT = ord('h')
+_BASE64 = ord('u')
+_END = ord('s')
 
-        try:
-            if data[0] == ord('i'):
-                return deserialize_int(data[1:])
-            elif data[0] == ord('l'):
-                return deserialize_list(data[1:])
-            elif data[0] == ord('h'):
-                return deserialize_dict(data[1:])
-            elif data[0] == ord('u'):
-                return deserialize_string(data[1:], is_base64=True)
-            else:
-                return deserialize_string(data)
-        except:
-            return (None, None)
+
+def _decode(data, offset, end):
+    """Decode the token starting at offset in data, not looking past end.
+
+    Works directly on the given buffer without slicing off the remainder, so
+    decoding a message is linear in its size.
+
+    :return: (value, offset) where offset is the position after the token
+    """
+    if offset >= end:
+        raise _Incomplete("Unexpected end of data")
+
+    kind = data[offset]
+    if kind == _INT:
+        stop = data.find(b's', offset + 1, end)
+        if stop < 0:
+            raise _Incomplete("Unterminated int")
+        return (int(data[offset + 1:stop], 16), stop + 1)
+
+    if kind == _LIST:
+        result = []
+        offset += 1
+        while offset < end and data[offset] != _END:
+            value, offset = _decode(data, offset, end)
+            result.append(value)
+        if offset >= end:
+            raise _Incomplete("Unterminated list")
+        return (result, offset + 1)
+
+    if kind == _DICT:
+        result = {}
+        offset += 1
+        while offset < end and data[offset] != _END:
+            key, offset = _decode(data, offset, end)
+            value, offset = _decode(data, offset, end)
+            result[str(key)] = value
+        if offset >= end:
+            raise _Incomplete("Unterminated dict")
+        return (result, offset + 1)
+
+    is_base64 = kind == _BASE64
+    start, stop = _string_range(data, offset + 1 if is_base64 else offset,
+                                end)
+    if is_base64:
+        return (base64.standard_b64decode(data[start:stop]), stop)
+    return (data[start:stop].decode('utf-8'), stop)
+
+
+def _string_range(data, offset, end):
+    """Locate the bytes of the string token starting at offset in data.
+
+    :return: (start, stop) of the string, stop is also the end of the token
+    """
+    if offset >= end:
+        raise _Incomplete("Unexpected end of data")
+    if data[offset] in (_INT, _LIST, _DICT, _BASE64):
+        raise ValueError("Not a string")
+    colon = data.find(b':', offset, end)
+    if colon < 0:
+        raise _Incomplete("Missing string length")
+    length = int(data[offset:colon], 16)
+    if length < 0:
+        raise ValueError("Invalid string length")
+    if colon + 1 + length > end:
+        raise _Incomplete("String exceeds data")
+    return colon + 1, colon + 1 + length
 
 
 class LiveMessage(object):
@@ -133,23 +149,69 @@ class LiveMessage(object):
         envelope.append(data.decode('utf-8'))
         return envelope
 
+    def serialize_signed(self, private_key, hash_method, buffer=None):
+        """Serialize the message wrapped in a signed envelope.
+
+        Same result as create_signed_message().serialize(), but the message
+        is serialized directly into the envelope.
+
+        :return: buffer (or a new bytearray) with the envelope appended
+        """
+        if buffer is None:
+            buffer = bytearray()
+        start = len(buffer)
+        self.serialize(buffer)
+        return LiveMessage.sign_serialized(buffer, start, private_key,
+                                           hash_method)
+
+    @staticmethod
+    def sign_serialized(buffer, start, private_key, hash_method):
+        """Wrap the serialized message in buffer[start:] in a signed
+        envelope, in place.
+
+        :return: buffer
+        """
+        with memoryview(buffer) as view, view[start:] as data:
+            signature = LiveMessage.signature(data, private_key, hash_method)
+            length = len(data)
+
+        header = bytearray()
+        _encode_str(signature, header)
+        header += b'%X:' % length
+        buffer[start:start] = header
+        return buffer
+
     def verify_signature(self, private_key, hash_method):
         data = self.parameter(0).encode('utf-8')
         signature = LiveMessage.signature(data, private_key, hash_method)
         return self.subject() == signature
 
-    def serialize(self):
-        tokens = [LiveMessageToken(t).serialize() for t in self.tokens]
-        return b''.join(tokens)
+    def serialize(self, buffer=None):
+        """Serialize the message.
+
+        :return: buffer (or a new bytearray) with the message appended
+        """
+        if buffer is None:
+            buffer = bytearray()
+        for token in self.tokens:
+            _encode(token, buffer)
+        return buffer
 
     @staticmethod
-    def deserialize(data):
+    def deserialize(data, offset=0, end=None):
+        """Deserialize the tokens in data[offset:end] into a new message.
+
+        Decoding stops at the first invalid token.
+        """
+        if end is None:
+            end = len(data)
         message = LiveMessage()
-        while data:
-            token, data = LiveMessageToken.deserialize(data)
-            if not token:
+        while offset < end:
+            try:
+                value, offset = _decode(data, offset, end)
+            except (ValueError, RuntimeError):
                 break
-            message.append(token.value)
+            message.append(value)
         return message
 
     @staticmethod
@@ -164,3 +226,106 @@ class LiveMessage(object):
         signature.update(data)
         signature.update(private_key.encode('ascii'))
         return signature.hexdigest().lower()
+
+
+def _encode_int(value, buffer):
+    buffer += b'i%Xs' % value
+
+
+def _encode_str(value, buffer):
+    value = value.encode('utf-8')
+    buffer += b'%X:' % len(value)
+    buffer += value
+
+
+def _encode_bytes(value, buffer):
+    value = base64.standard_b64encode(value)
+    buffer += b'u%X:' % len(value)
+    buffer += value
+
+
+def _encode_list(value, buffer):
+    buffer.append(_LIST)
+    for item in value:
+        _encode(item, buffer)
+    buffer.append(_END)
+
+
+def _encode_dict(value, buffer):
+    buffer.append(_DICT)
+    for key, item in value.items():
+        _encode_str(str(key), buffer)
+        _encode(item, buffer)
+    buffer.append(_END)
+
+
+_ENCODERS = {
+    int: _encode_int,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    list: _encode_list,
+    dict: _encode_dict,
+}
+
+
+def _encode(value, buffer):
+    """Append the serialized value to buffer (a bytearray)."""
+    try:
+        encoder = _ENCODERS[type(value)]
+    except KeyError:
+        raise RuntimeError("Unknown type %s" % type(value)) from None
+    encoder(value, buffer)
+
+
+class LiveMessageDecoder(object):
+    """Incremental decoder for a stream of signed envelopes.
+
+    Data is fed as it arrives and every complete envelope is returned, no
+    matter how the stream was split into reads.
+    """
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        """Yield (signature, start, stop) for each complete envelope in the
+        buffer, where buffer[start:stop] is the serialized message.
+
+        The message bytes can thus be verified and decoded directly in the
+        buffer. The envelopes are consumed when the iteration ends, so the
+        buffer must not be modified (or have exported views) until then.
+
+        :raises ValueError: if the buffer holds an invalid envelope
+        """
+        data = self.buffer
+        offset = 0
+        end = len(data)
+        try:
+            while offset < end:
+                signature, start = _decode(data, offset, end)
+                if type(signature) != str:
+                    raise ValueError("Invalid envelope")
+                start, stop = _string_range(data, start, end)
+                offset = stop
+                yield signature, start, stop
+        except _Incomplete:
+            pass
+        finally:
+            del data[:offset]
+
+    def envelopes(self):
+        """Return all complete envelopes in the buffer and consume them.
+
+        An empty list means that more data is needed.
+
+        :raises ValueError: if the buffer holds an invalid envelope
+        """
+        envelopes = []
+        for signature, start, stop in self.frames():
+            envelope = LiveMessage(signature)
+            envelope.append(self.buffer[start:stop].decode('utf-8'))
+            envelopes.append(envelope)
+        return envelopes
@@ -0,0 +1,222 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+"""Counters, gauges and histograms in the Prometheus text format.
+
+All metrics are registered in REGISTRY, which can be served over HTTP with
+serve() or written to a file (e.g. for the node exporter textfile collector)
+with write_textfile().
+"""
+
+import http.server
+import logging
+import os
+import threading
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def samples(self):
+        """Return list of (name, label string, value) to render."""
+        with self.lock:
+            values = list(self.values.items())
+        return [(self.name, _format_labels(self.labels, key), value)
+                for key, value in sorted(values)]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.TYPE)]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.functions = {}
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def set_function(self, function, *labels):
+        """Set the value to the result of calling function when rendered.
+
+        Pass None as function to remove it.
+        """
+        with self.lock:
+            if function is None:
+                self.functions.pop(labels, None)
+                self.values.pop(labels, None)
+            else:
+                self.functions[labels] = function
+
+    def samples(self):
+        with self.lock:
+            functions = list(self.functions.items())
+        for labels, function in functions:
+            try:
+                self.set(function(), *labels)
+            except Exception as e:
+                logging.debug("Could not get %s: %s", self.name, e)
+        return super().samples()
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # Count per bucket, then sum
+                counts = self.values[labels] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(k, list(v)) for k, v in self.values.items()]
+        samples = []
+        for key, counts in sorted(values):
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                samples.append((
+                    self.name + "_bucket",
+                    _format_labels(self.labels, key,
+                                   [("le", _format_value(bound))]),
+                    total))
+            labels = _format_labels(self.labels, key)
+            samples.append((self.name + "_sum", labels, counts[-1]))
+            samples.append((self.name + "_count", labels, total))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[name] = metric
+            elif type(metric) != cls:
+                raise ValueError("{} is a {}".format(name, metric.TYPE))
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return "".join(m.render() + "\n" for _, m in metrics)
+
+
+REGISTRY = Registry()
+
+
+def serve(port, address='127.0.0.1', registry=REGISTRY):
+    """Serve the metrics over HTTP in a background thread.
+
+    :return: the server, call shutdown() on it to stop serving
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("Metrics request: " + format, *args)
+
+    server = http.server.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    """Atomically write the metrics to path."""
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
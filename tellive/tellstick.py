@@ -15,16 +15,43 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
-from .livemessage import LiveMessage
+from . import metrics
+from .livemessage import LiveMessage, LiveMessageDecoder
 
+import collections
+import hashlib
 import http.client as http
+import itertools
 import logging
 import platform
+import queue
+import select
 import socket
 import ssl
+import threading
 import time
 import xml.parsers.expat as expat
 
+MESSAGES_SENT = metrics.REGISTRY.counter(
+    "tellive_messages_sent_total", "Messages sent to Telldus Live",
+    ["subject"])
+BYTES_SENT = metrics.REGISTRY.counter(
+    "tellive_bytes_sent_total", "Bytes sent to Telldus Live", ["subject"])
+MESSAGES_RECEIVED = metrics.REGISTRY.counter(
+    "tellive_messages_received_total", "Messages received from Telldus Live",
+    ["subject"])
+BYTES_RECEIVED = metrics.REGISTRY.counter(
+    "tellive_bytes_received_total", "Bytes received from Telldus Live")
+CODEC_SECONDS = metrics.REGISTRY.histogram(
+    "tellive_codec_seconds",
+    "Time spent encoding, signing, verifying and decoding messages",
+    ["operation"])
+CONNECTS = metrics.REGISTRY.counter(
+    "tellive_connects_total", "Attempts to connect to Telldus Live",
+    ["result"])
+CONNECT_SECONDS = metrics.REGISTRY.histogram(
+    "tellive_connect_seconds", "Time taken to connect to Telldus Live")
+
 
 class TellstickLiveClient(object):
     # dict(supportedMethods)
@@ -38,20 +65,85 @@ class TellstickLiveClient(object):
     # <no parameters>
     SUBJECT_DISCONNECT = "disconnect"
 
-    def __init__(self, public_key, private_key):
+    # A full report identical to the last one sent is still sent if that
+    # was longer ago than this (seconds)
+    REPORT_MAX_AGE = 24 * 60 * 60
+
+    # Messages kept in the journal while not connected
+    JOURNAL_SUBJECTS = ("deviceevent", "sensorevent")
+
+    # Max number of bytes to read from the socket at a time
+    RECEIVE_SIZE = 64 * 1024
+
+    # Something must be sent to the server at least this often (seconds)
+    PING_INTERVAL = 2 * 60
+    # Something should be received from the server at least this often
+    PONG_INTERVAL = 6 * 60
+
+    # Number of seconds to use the server list before fetching it again
+    SERVER_CACHE_TTL = 60 * 60
+    # Max number of servers to try to connect to at the same time
+    CONNECT_PARALLEL = 3
+    # Number of seconds to wait for a connection before trying the next
+    # server in parallel
+    CONNECT_DELAY = 0.25
+
+    # Max number of bytes to write to the socket at a time when using the
+    # send queue (about one TLS record)
+    WRITE_SIZE = 16 * 1024
+
+    def __init__(self, public_key, private_key, send_queue_size=None,
+                 ssl_context=None, journal=None):
+        """
+        :param send_queue_size: if set, send_message() only queues messages
+            (up to this many) and write_pending() must be called when the
+            socket is writable, see waits_for_writable(). The socket is
+            non-blocking once connected.
+        :param ssl_context: SSL context to use instead of creating one, e.g.
+            to share it between many clients
+        :param journal: a Journal to keep device and sensor events in until
+            replay_journal() is called after each connect
+        """
         super().__init__()
         self.socket = None
+        self.send_queue_size = send_queue_size
+        # key -> message, see _queue_key()
+        self.send_queue = collections.OrderedDict()
+        self.send_buffer = bytearray()
+        self._queue_ids = itertools.count()
+        # The last SSL read needs the socket to be writable, or the last
+        # write needs it to be readable, before it can continue
+        self.read_wants_write = False
+        self.write_wants_read = False
+        # Seconds to wait for the socket to become ready
+        self.timeout = None
+        self.decoder = LiveMessageDecoder()
+        self.received = collections.deque()
         self.public_key = public_key
         self.private_key = private_key
         self.hash_method = "sha1"
         self.time_sent = 0
         self.time_received = 0
+        self.server_cache = []
+        self.server_cache_time = 0
+        self.address = None
+        self.sessions = {}
+        self._ssl_context = ssl_context
+        self.journal = journal
+        self.journaling = journal is not None
+        # subject -> [hash, time sent] of the last DevicesReport and
+        # SensorsReport, if set unchanged reports are not sent again
+        self.report_hashes = None
 
     def ssl_context(self):
-        context = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-        context.verify_mode = ssl.CERT_REQUIRED
-        context.set_default_verify_paths()
-        return context
+        """Return the SSL context shared by all connections.
+
+        The certificate and host name of the server are verified during the
+        handshake.
+        """
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
 
     def servers(self, server='api.telldus.com', port=http.HTTPS_PORT):
         """Fetch list of servers that can be connected to.
@@ -82,50 +174,391 @@ class TellstickLiveClient(object):
         logging.debug("Found %d available servers", len(servers))
         return servers
 
-    def connect(self, address, timeout=5):
+    def cached_servers(self):
+        """Return the list of servers, fetching it if the cached one is
+        older than SERVER_CACHE_TTL.
+
+        The server that was connected to the last time is listed first.
+        """
+        if time.time() - self.server_cache_time > self.SERVER_CACHE_TTL \
+           or not self.server_cache:
+            try:
+                servers = self.servers()
+            except Exception:
+                if not self.server_cache:
+                    raise
+                logging.debug("Using stale server list")
+            else:
+                if self.server_cache and self.server_cache[0] in servers:
+                    servers.remove(self.server_cache[0])
+                    servers.insert(0, self.server_cache[0])
+                self.server_cache = servers
+                self.server_cache_time = time.time()
+        return list(self.server_cache)
+
+    def _connect_socket(self, address, timeout):
+        # Offer the session from the last connection to the server, to
+        # resume it instead of doing a full handshake
         sock = self.ssl_context().wrap_socket(
-            socket.socket(socket.AF_INET, socket.SOCK_STREAM))
-        sock.settimeout(timeout)
-        sock.connect(address)
-        ssl.match_hostname(sock.getpeercert(), address[0])
+            socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+            server_hostname=address[0], session=self.sessions.get(address))
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+        except:
+            sock.close()
+            raise
+        if sock.session_reused:
+            logging.debug("Resumed TLS session with %s:%d",
+                          address[0], address[1])
+        return sock
+
+    def _save_session(self):
+        if self.socket and self.socket.session:
+            self.sessions[self.address] = self.socket.session
+
+    def _connected(self, address, sock):
+        self.address = address
         self.socket = sock
+        self.timeout = sock.gettimeout()
+        if self.send_queue_size is not None:
+            sock.setblocking(False)
+        self.send_queue.clear()
+        del self.send_buffer[:]
+        self.read_wants_write = self.write_wants_read = False
+        self._save_session()
+        self.decoder = LiveMessageDecoder()
+        self.received.clear()
         self.time_sent = time.time()
         self.time_received = self.time_sent
 
-    def connect_to_first_available_server(self, **kwargs):
-        for server in self.servers():
+    def connect(self, address, timeout=5):
+        self._connected(address, self._connect_socket(address, timeout))
+
+    def connect_to_first_available_server(self, timeout=5):
+        """Connect to the first server that accepts the connection.
+
+        Up to CONNECT_PARALLEL servers are tried at the same time. A new
+        attempt is started every CONNECT_DELAY seconds, or as soon as one
+        fails, and the first successful connection is kept.
+
+        :return: (address, port) of the server connected to
+        """
+        start = time.perf_counter()
+        servers = self.cached_servers()
+        results = queue.Queue()
+        lock = threading.Lock()
+        done = []
+
+        def attempt(server):
             try:
                 logging.debug("Connecting to %s:%d", server[0], server[1])
-                self.connect(server, **kwargs)
-                return server
-            except:
-                pass
-        raise RuntimeError("Could not connect to any available server")
+                sock = self._connect_socket(server, timeout)
+            except Exception as e:
+                logging.debug("Could not connect to %s:%d: %s",
+                              server[0], server[1], e)
+                sock = None
+            with lock:
+                if done and sock:
+                    # Someone else won
+                    sock.close()
+                    return
+                results.put((server, sock))
+
+        pending = 0
+        winner = None
+        while servers or pending:
+            if servers and pending < self.CONNECT_PARALLEL:
+                thread = threading.Thread(target=attempt,
+                                          args=(servers.pop(0),))
+                thread.daemon = True
+                thread.start()
+                pending += 1
+            try:
+                server, sock = results.get(
+                    timeout=self.CONNECT_DELAY if servers else None)
+            except queue.Empty:
+                continue
+            pending -= 1
+            if sock:
+                winner = (server, sock)
+                break
+
+        with lock:
+            done.append(True)
+        while not results.empty():
+            server, sock = results.get()
+            if sock:
+                sock.close()
+
+        if not winner:
+            # Fetch a fresh list next time
+            self.server_cache_time = 0
+            CONNECTS.inc("failure")
+            raise RuntimeError("Could not connect to any available server")
+
+        CONNECTS.inc("success")
+        CONNECT_SECONDS.observe(time.perf_counter() - start)
+        server, sock = winner
+        self.server_cache = [server] + \
+            [s for s in self.server_cache if s != server]
+        self._connected(server, sock)
+        return server
 
     def disconnect(self):
+        self.journaling = self.journal is not None
+        if self.report_hashes and self.wants_write():
+            # The reports might not have been sent
+            self.report_hashes.clear()
+        if self.journaling:
+            # Keep the queued events that were never written
+            for message in self.send_queue.values():
+                self._journaled(message)
+            self.send_queue.clear()
         if self.socket:
+            # With TLS 1.3 the session is only available after the handshake
+            self._save_session()
             self.socket.close()
             self.socket = None
 
+    def _journaled(self, message):
+        """Add message to the journal if it should be kept there.
+
+        :return: True if the message was added
+        """
+        if not self.journaling \
+           or message.subject() not in self.JOURNAL_SUBJECTS:
+            return False
+        self.journal.append(bytes(message.serialize()))
+        return True
+
+    def replay_journal(self):
+        """Send the events in the journal and stop journaling.
+
+        Should be called once registered. Device events are sent in the
+        order they happened, while the events for each sensor are merged
+        into one with the newest value of each type.
+
+        :return: number of messages sent
+        """
+        messages = self._take_journal()
+        for message in messages:
+            self.send_message(message)
+        return len(messages)
+
+    def _take_journal(self):
+        """Stop journaling and return the merged messages in the journal."""
+        if self.journal is None:
+            return []
+        messages = collections.OrderedDict()
+        for record in self.journal.records():
+            message = LiveMessage.deserialize(record)
+            key = self._queue_key(message)
+            if key in messages:
+                message = self._merge(messages.pop(key), message)
+            messages[key] = message
+        self.journaling = False
+        self.journal.clear()
+
+        if messages:
+            logging.debug("Replaying %d journaled messages", len(messages))
+        return list(messages.values())
+
     def send_message(self, message):
-        envelope = message.create_signed_message(
-            self.private_key, self.hash_method)
+        if self._journaled(message):
+            return
+        if self.send_queue_size is not None:
+            self._queue_message(message)
+            return
 
-        data = envelope.serialize()
+        data = self._serialize(message, bytearray())
         logging.debug("Sending: %s", data)
         self.socket.write(data)
         self.time_sent = time.time()
 
-    def receive_message(self):
-        data = self.socket.read(1024)
-        logging.debug("Received: %s", data)
-        self.time_received = time.time()
+    def _serialize(self, message, buffer):
+        """Append message, in a signed envelope, to buffer."""
+        start = len(buffer)
+        encode_start = time.perf_counter()
+        message.serialize(buffer)
+        sign_start = time.perf_counter()
+        LiveMessage.sign_serialized(buffer, start, self.private_key,
+                                    self.hash_method)
+        end = time.perf_counter()
+
+        CODEC_SECONDS.observe(sign_start - encode_start, "encode")
+        CODEC_SECONDS.observe(end - sign_start, "sign")
+        subject = message.subject()
+        MESSAGES_SENT.inc(subject)
+        BYTES_SENT.inc(subject, amount=len(buffer) - start)
+        return buffer
+
+    def _queue_key(self, message):
+        """Return the key of a message in the send queue.
+
+        A queued SensorEvent is replaced by a newer one for the same sensor,
+        all other messages get a unique key.
+        """
+        if message.subject() == "sensorevent":
+            s = message.parameter(0)
+            return ("sensorevent", s['protocol'], s['model'], s['sensor_id'])
+        return next(self._queue_ids)
+
+    @staticmethod
+    def _merge(old, message):
+        """Merge two SensorEvents, keeping the newest value of each type."""
+        values = collections.OrderedDict(
+            (v['type'], v) for v in old.parameter(1))
+        values.update((v['type'], v) for v in message.parameter(1))
+        message.tokens[2] = list(values.values())
+        return message
+
+    def _queue_message(self, message):
+        key = self._queue_key(message)
+        if key in self.send_queue:
+            self.send_queue[key] = self._merge(self.send_queue[key], message)
+            return
+
+        if len(self.send_queue) >= self.send_queue_size:
+            sensor_events = [k for k in self.send_queue
+                             if isinstance(k, tuple)]
+            if sensor_events:
+                logging.debug("Send queue full, dropping %s",
+                              sensor_events[0])
+                del self.send_queue[sensor_events[0]]
+            else:
+                # Block until there is room in the queue
+                logging.debug("Send queue full, waiting for socket")
+                while len(self.send_queue) >= self.send_queue_size:
+                    if not self.write_pending():
+                        self._wait_for_socket()
+        self.send_queue[key] = message
+
+    def wants_write(self):
+        """Return True if there is queued data to write."""
+        return bool(self.send_queue or self.send_buffer)
+
+    def waits_for_writable(self):
+        """Return True if write_pending() should be called once the socket
+        is writable."""
+        if self.read_wants_write:
+            return True
+        return self.wants_write() and not self.write_wants_read
+
+    def _wait_for_socket(self):
+        """Wait until the socket is readable, or writable if
+        waits_for_writable(), for at most timeout seconds."""
+        writable = [self.socket] if self.waits_for_writable() else []
+        if not any(select.select([self.socket], writable, [],
+                                 self.timeout)):
+            raise socket.timeout("Timed out waiting for the server")
+
+    def write_pending(self):
+        """Write queued messages to the socket.
+
+        Messages are signed and serialized into one buffer, which is written
+        with a single call of at most WRITE_SIZE bytes.
+
+        :return: number of bytes written
+        """
+        if self.read_wants_write:
+            # Let the read continue, the messages are kept in received
+            self._read()
+
+        while self.send_queue and len(self.send_buffer) < self.WRITE_SIZE:
+            _, message = self.send_queue.popitem(last=False)
+            self._serialize(message, self.send_buffer)
+        if not self.send_buffer:
+            return 0
+
+        self.write_wants_read = False
+        try:
+            with memoryview(self.send_buffer) as view, \
+                    view[:self.WRITE_SIZE] as data:
+                written = self.socket.send(data)
+        except (ssl.SSLWantWriteError, BlockingIOError):
+            return 0
+        except ssl.SSLWantReadError:
+            self.write_wants_read = True
+            return 0
+        logging.debug("Sent %d queued bytes", written)
+        del self.send_buffer[:written]
+        self.time_sent = time.time()
+        return written
+
+    def _decode_received(self):
+        """Verify and decode all complete messages in the receive buffer.
 
-        envelope = LiveMessage.deserialize(data)
-        if not envelope.verify_signature(self.private_key, self.hash_method):
-            raise ValueError("Signature verification failed")
+        The signature is computed over, and the message decoded from, the
+        message bytes in the receive buffer without copying them.
+        """
+        buffer = self.decoder.buffer
+        for signature, start, stop in self.decoder.frames():
+            verify_start = time.perf_counter()
+            with memoryview(buffer) as view, view[start:stop] as data:
+                expected = LiveMessage.signature(data, self.private_key,
+                                                 self.hash_method)
+            if signature.lower() != expected:
+                raise ValueError("Signature verification failed")
+            decode_start = time.perf_counter()
+            message = LiveMessage.deserialize(buffer, start, stop)
+            end = time.perf_counter()
+
+            CODEC_SECONDS.observe(decode_start - verify_start, "verify")
+            CODEC_SECONDS.observe(end - decode_start, "decode")
+            MESSAGES_RECEIVED.inc(
+                message.subject() if message.tokens else "")
+            self.received.append(message)
+
+    def _read(self):
+        """Read and decode the data available on the socket."""
+        self.read_wants_write = False
+        # New data might be what a waiting write needs
+        self.write_wants_read = False
+        data = b''
+        try:
+            data = self.socket.read(self.RECEIVE_SIZE)
+            if not data:
+                raise RuntimeError("Connection closed by server")
+            # Data already decrypted by the SSL layer is not seen by select
+            while self.socket.pending():
+                data += self.socket.read(self.socket.pending())
+        except (ssl.SSLWantReadError, BlockingIOError):
+            pass
+        except ssl.SSLWantWriteError:
+            self.read_wants_write = True
+
+        if data:
+            logging.debug("Received: %s", data)
+            self.time_received = time.time()
+            BYTES_RECEIVED.inc(amount=len(data))
+            self.decoder.feed(data)
+
+        self._decode_received()
 
-        return LiveMessage.deserialize(envelope.parameter(0).encode('utf-8'))
+    def receive_messages(self):
+        """Read the data available on the socket and return all complete
+        messages received so far.
+
+        An empty list is returned if more data is needed to complete a
+        message.
+        """
+        self._read()
+        messages = list(self.received)
+        self.received.clear()
+        return messages
+
+    def receive_message(self):
+        """Block until a message is received and return it."""
+        while not self.received:
+            if self.send_queue_size is not None \
+               and not self.socket.pending():
+                # The socket is non-blocking
+                self._wait_for_socket()
+                if self.waits_for_writable():
+                    self.write_pending()
+            self.received.extend(self.receive_messages())
+        return self.received.popleft()
 
     def register(self, version, uuid=""):
         message = LiveMessage("Register")
@@ -133,7 +566,11 @@ class TellstickLiveClient(object):
                         'hash': self.hash_method})
         os = platform.system().lower()
         if os == "linux":
-            os_version = platform.linux_distribution()[0]
+            try:
+                os_version = platform.linux_distribution()[0]
+            except AttributeError:
+                # Removed in Python 3.8
+                os_version = ""
         elif os == "darwin":
             os = "macosx"
             os_version = platform.mac_ver()[0]
@@ -143,36 +580,58 @@ class TellstickLiveClient(object):
             os_version = ""
         message.append({'protocol': 2, 'version': str(version),
                         'os': os, 'os-version': os_version.lower()})
-        self.send_message(message)
+        return self.send_message(message)
 
     def ping(self):
         message = LiveMessage("Ping")
-        self.send_message(message)
+        return self.send_message(message)
 
     def acknowledge(self, cookie):
         message = LiveMessage("ACK")
         message.append(cookie)
-        self.send_message(message)
+        return self.send_message(message)
+
+    def device_values(self, device, supported_methods):
+        """Return the values reported for device in a DevicesReport."""
+        dev = {'id': device.id, 'name': device.name}
+        dev['methods'] = device.methods(supported_methods)
+        dev['state'] = device.last_sent_command(supported_methods)
+        last_sent = device.last_sent_value()
+        dev['stateValue'] = str('' if last_sent is None else last_sent)
+        return dev
 
     def report_devices(self, devices, supported_methods):
-        dev_list = []
-        for device in devices:
-            dev = {'id': device.id, 'name': device.name}
-            dev['methods'] = device.methods(supported_methods)
-            dev['state'] = device.last_sent_command(supported_methods)
-            last_sent = device.last_sent_value()
-            dev['stateValue'] = str('' if last_sent is None else last_sent)
-            dev_list.append(dev)
+        dev_list = [self.device_values(device, supported_methods)
+                    for device in devices]
+        return self.report_device_list(dev_list)
+
+    def report_device_list(self, dev_list):
+        """Report devices given as returned by device_values()."""
         message = LiveMessage("DevicesReport")
         message.append(dev_list)
-        self.send_message(message)
+        return self._send_report(message)
+
+    def _send_report(self, message):
+        """Send a full report, unless report_hashes shows that the same
+        report has been sent within REPORT_MAX_AGE."""
+        if self.report_hashes is None:
+            return self.send_message(message)
+        subject = message.subject()
+        digest = hashlib.sha1(message.serialize()).hexdigest()
+        now = time.time()
+        last = self.report_hashes.get(subject)
+        if last and last[0] == digest and now - last[1] < self.REPORT_MAX_AGE:
+            logging.debug("%s unchanged, not sending", subject)
+            return None
+        self.report_hashes[subject] = [digest, now]
+        return self.send_message(message)
 
     def report_device_event(self, device_id, method, data):
         message = LiveMessage("DeviceEvent")
         message.append(device_id)
         message.append(method)
         message.append(data)
-        self.send_message(message)
+        return self.send_message(message)
 
     def _sensor(self, sensor):
         value_list = []
@@ -197,11 +656,24 @@ class TellstickLiveClient(object):
 
         message = LiveMessage("SensorsReport")
         message.append(sensor_list)
-        self.send_message(message)
+        return self._send_report(message)
 
     def report_sensor_values(self, sensor):
         s, value_list = self._sensor(sensor)
         message = LiveMessage("SensorEvent")
         message.append(s)
         message.append(value_list)
-        self.send_message(message)
+        return self.send_message(message)
+
+    def report_sensor_event(self, protocol, model, sensor_id, values):
+        """Report sensor values without reading them from a sensor object.
+
+        :param values: list of (datatype, value, timestamp) tuples
+        """
+        s = {'protocol': protocol, 'model': model, 'sensor_id': sensor_id}
+        value_list = [{'type': datatype, 'value': value, 'lastUp': timestamp}
+                      for datatype, value, timestamp in values]
+        message = LiveMessage("SensorEvent")
+        message.append(s)
+        message.append(value_list)
+        return self.send_message(message)
@@ -0,0 +1,192 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import array
+import logging
+import mmap
+import os
+import struct
+import urllib.parse
+
+# magic, capacity, number of records appended
+_HEADER = struct.Struct('<4sQQ')
+_MAGIC = b'TLT1'
+_DATA = 32
+# timestamp, value
+_RECORD = struct.Struct('<qd')
+
+_SUFFIX = ".ts"
+
+
+class TimeSeries(object):
+    """Fixed-size ring of (timestamp, value) readings in a memory-mapped
+    file.
+
+    Readings should be appended in time order. When the file is full the
+    oldest reading is overwritten, and the readings are kept when the file
+    is opened again.
+    """
+    def __init__(self, path, size=1024 * 1024):
+        super().__init__()
+        self.path = path
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists or os.path.getsize(path) < _DATA + _RECORD.size:
+            self.file.truncate(max(size, _DATA + _RECORD.size))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        capacity = (len(self.map) - _DATA) // _RECORD.size
+
+        magic, self.capacity, self.appended = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC or self.capacity != capacity:
+            if exists:
+                logging.warning("Invalid time series %s, starting a new one",
+                                path)
+            self.capacity = capacity
+            self.clear()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def clear(self):
+        """Remove all readings."""
+        self.appended = 0
+        _HEADER.pack_into(self.map, 0, _MAGIC, self.capacity, 0)
+
+    def _offset(self, index):
+        """Return the file offset of the index:th oldest reading."""
+        first = max(0, self.appended - self.capacity)
+        return _DATA + (first + index) % self.capacity * _RECORD.size
+
+    def append(self, timestamp, value):
+        _RECORD.pack_into(self.map, _DATA + self.appended % self.capacity
+                          * _RECORD.size, timestamp, value)
+        self.appended += 1
+        _HEADER.pack_into(self.map, 0, _MAGIC, self.capacity, self.appended)
+
+    def last(self):
+        """Return the newest reading as (timestamp, value), or None."""
+        if not self.appended:
+            return None
+        return _RECORD.unpack_from(self.map, self._offset(len(self) - 1))
+
+    def _timestamp(self, index):
+        return struct.unpack_from('<q', self.map, self._offset(index))[0]
+
+    def _bisect(self, timestamp):
+        """Return the index of the first reading at or after timestamp."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start=None, end=None):
+        """Return the readings from start up to and including end.
+
+        :return: (timestamps, values) as array.array
+        """
+        first = 0 if start is None else self._bisect(start)
+        stop = len(self) if end is None else self._bisect(end + 1)
+
+        # The readings are in at most two parts of the ring
+        data = bytearray()
+        while first < stop:
+            offset = self._offset(first)
+            count = min(stop - first,
+                        self.capacity - (offset - _DATA) // _RECORD.size)
+            data += self.map[offset:offset + count * _RECORD.size]
+            first += count
+        return array.array('q', data)[0::2], array.array('d', data)[1::2]
+
+    def downsample(self, interval, start=None, end=None):
+        """Summarize the readings from start to end in buckets of interval
+        seconds.
+
+        :return: list of (bucket start, min, max, average) for the buckets
+            that have readings
+        """
+        timestamps, values = self.range(start, end)
+        result = []
+        bucket = None
+        for timestamp, value in zip(timestamps, values):
+            if bucket is None or timestamp - timestamp % interval != bucket:
+                if bucket is not None:
+                    result.append((bucket, low, high, total / count))
+                bucket = timestamp - timestamp % interval
+                low = high = total = value
+                count = 1
+            else:
+                low = min(low, value)
+                high = max(high, value)
+                total += value
+                count += 1
+        if bucket is not None:
+            result.append((bucket, low, high, total / count))
+        return result
+
+
+class TimeSeriesStore(object):
+    """A directory with one TimeSeries per sensor and data type."""
+    def __init__(self, directory, size=1024 * 1024):
+        super().__init__()
+        self.directory = directory
+        self.size = size
+        self._series = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name, datatype):
+        return os.path.join(self.directory, "{}.{}{}".format(
+            urllib.parse.quote(name, safe=''), datatype, _SUFFIX))
+
+    def series(self, name, datatype):
+        """Return the TimeSeries of a sensor and data type, created if
+        needed."""
+        key = (name, datatype)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = TimeSeries(
+                self._path(name, datatype), self.size)
+        return series
+
+    def append(self, name, datatype, timestamp, value):
+        self.series(name, datatype).append(timestamp, value)
+
+    def keys(self):
+        """Return (name, datatype) of all series in the directory."""
+        keys = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(_SUFFIX):
+                continue
+            name, _, datatype = filename[:-len(_SUFFIX)].rpartition('.')
+            try:
+                keys.append((urllib.parse.unquote(name), int(datatype)))
+            except ValueError:
+                pass
+        return keys
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
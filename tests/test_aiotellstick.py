@@ -0,0 +1,183 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import asyncio
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import unittest
+
+from tellive.aiotellstick import AsyncTellstickLiveClient
+from tellive.journal import Journal
+from tellive.livemessage import LiveMessage, LiveMessageDecoder
+
+PRIVATE_KEY = "private"
+
+
+class FakeWriter(object):
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def signed(subject, *parameters):
+    message = LiveMessage(subject)
+    for parameter in parameters:
+        message.append(parameter)
+    return message.serialize_signed(PRIVATE_KEY, "sha1")
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.client = AsyncTellstickLiveClient("public", PRIVATE_KEY)
+        self.client.writer = FakeWriter()
+
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_send_message(self):
+        self.run_async(self.client.ping())
+        decoder = LiveMessageDecoder()
+        decoder.feed(self.client.writer.data)
+        envelope, = decoder.envelopes()
+        self.assertTrue(envelope.verify_signature(PRIVATE_KEY, "sha1"))
+        self.assertEqual(envelope.parameter(0), "4:Ping")
+
+    def test_receive_messages(self):
+        async def receive():
+            reader = asyncio.StreamReader()
+            self.client.reader = reader
+            data = signed("pong") + signed("command", {'id': 1})
+            reader.feed_data(data[:10])
+            reader.feed_data(data[10:])
+            reader.feed_eof()
+
+            messages = []
+            try:
+                async for message in self.client:
+                    messages.append(message)
+            except RuntimeError:
+                pass
+            return messages
+
+        messages = self.run_async(receive())
+        self.assertListEqual([m.subject() for m in messages],
+                             ["pong", "command"])
+        self.assertDictEqual(messages[1].parameter(0), {'id': 1})
+
+    def test_invalid_signature(self):
+        async def receive():
+            reader = asyncio.StreamReader()
+            self.client.reader = reader
+            message = LiveMessage("pong")
+            reader.feed_data(message.serialize_signed("wrong", "sha1"))
+            return await self.client.receive_message()
+
+        self.assertRaises(ValueError, self.run_async, receive())
+
+    def test_disconnect_ends_iteration(self):
+        async def receive():
+            self.client.reader = asyncio.StreamReader()
+            await self.client.disconnect()
+            return [message async for message in self.client]
+
+        self.assertListEqual(self.run_async(receive()), [])
+
+    def test_replay_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = Journal(os.path.join(directory, "test.journal"), 4096)
+            client = AsyncTellstickLiveClient("public", PRIVATE_KEY,
+                                              journal=journal)
+            self.run_async(client.report_device_event(1, 1, ""))
+            self.assertEqual(len(journal), 1)
+
+            client.writer = FakeWriter()
+            self.assertEqual(self.run_async(client.replay_journal()), 1)
+            self.assertEqual(len(journal), 0)
+            decoder = LiveMessageDecoder()
+            decoder.feed(client.writer.data)
+            self.assertEqual(len(list(decoder.envelopes())), 1)
+            journal.close()
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command")
+class TlsTest(unittest.TestCase):
+    """Connects to a local TLS server with a certificate for localhost."""
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.certfile = os.path.join(cls.directory.name, "cert.pem")
+        keyfile = os.path.join(cls.directory.name, "key.pem")
+        subprocess.check_call(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+             "-days", "1", "-subj", "/CN=localhost",
+             "-addext", "subjectAltName=DNS:localhost",
+             "-keyout", keyfile, "-out", cls.certfile],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.server_context = ssl.create_default_context(
+            ssl.Purpose.CLIENT_AUTH)
+        cls.server_context.load_cert_chain(cls.certfile, keyfile)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def connect(self, host):
+        async def connect():
+            async def handle(reader, writer):
+                await reader.read()
+                writer.close()
+
+            server = await asyncio.start_server(
+                handle, "127.0.0.1", 0, ssl=self.server_context)
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncTellstickLiveClient("public", PRIVATE_KEY)
+            client.ssl_context().load_verify_locations(self.certfile)
+            try:
+                await client.connect((host, port))
+                await client.disconnect()
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(connect())
+
+    def test_hostname_verified(self):
+        self.connect("localhost")
+
+    def test_hostname_mismatch(self):
+        self.assertRaises(ssl.SSLCertVerificationError, self.connect,
+                          "127.0.0.1")
+
+
+if __name__ == '__main__':
+    unittest.main()
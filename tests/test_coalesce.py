@@ -0,0 +1,171 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import unittest
+
+from tellive.coalesce import DeviceReportDebouncer, SensorEventCoalescer
+
+TEMPERATURE = 1
+HUMIDITY = 2
+
+
+class FakeDevice(object):
+    def __init__(self, id, name):
+        super().__init__()
+        self.id = id
+        self.name = name
+
+
+class FakeClient(object):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+        self.reports = []
+        self.device_lists = []
+        self.queried = []
+
+    def report_sensor_event(self, protocol, model, sensor_id, values):
+        self.events.append((protocol, model, sensor_id, values))
+
+    def device_values(self, device, supported_methods):
+        self.queried.append(device.id)
+        return {'id': device.id, 'name': device.name, 'state': 2,
+                'stateValue': ''}
+
+    def report_device_list(self, dev_list):
+        self.reports.append([d['name'] for d in dev_list])
+        self.device_lists.append(dev_list)
+
+
+class SensorEventCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.events = SensorEventCoalescer(self.client, window=2,
+                                           refresh_interval=60)
+
+    def add(self, datatype, value, now, sensor_id=1):
+        self.events.add("oregon", "ea4c", sensor_id, datatype, value,
+                        int(now), now=now)
+
+    def test_merge_within_window(self):
+        self.add(TEMPERATURE, "21.0", 100)
+        self.add(HUMIDITY, "40", 101)
+        self.add(TEMPERATURE, "21.1", 101)
+        self.assertEqual(self.events.timeout(101), 1)
+
+        self.assertEqual(self.events.flush(101.5), 0)
+        self.assertEqual(self.events.flush(102), 1)
+        self.assertListEqual(self.client.events, [
+            ("oregon", "ea4c", 1,
+             [(TEMPERATURE, "21.1", 101), (HUMIDITY, "40", 101)])])
+        self.assertIs(self.events.timeout(102), None)
+
+    def test_sensors_are_separate(self):
+        self.add(TEMPERATURE, "21.0", 100, sensor_id=1)
+        self.add(TEMPERATURE, "22.0", 100, sensor_id=2)
+        self.assertEqual(self.events.flush(102), 2)
+
+    def test_drop_unchanged(self):
+        self.add(TEMPERATURE, "21.0", 100)
+        self.events.flush(102)
+        self.add(TEMPERATURE, "21.0", 110)
+        self.assertEqual(self.events.flush(112), 0)
+        self.add(TEMPERATURE, "21.5", 120)
+        self.assertEqual(self.events.flush(122), 1)
+        self.assertEqual(len(self.client.events), 2)
+
+    def test_resend_unchanged_after_refresh_interval(self):
+        self.add(TEMPERATURE, "21.0", 100)
+        self.events.flush(102)
+        self.add(TEMPERATURE, "21.0", 170)
+        self.assertEqual(self.events.flush(172), 1)
+
+    def test_force_flush(self):
+        self.add(TEMPERATURE, "21.0", 100)
+        self.assertEqual(self.events.flush(100, force=True), 1)
+
+
+class DeviceReportDebouncerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.names = {1: "a", 2: "b"}
+        self.reports = DeviceReportDebouncer(
+            self.client, self.device, delay=1)
+
+    def device(self, device_id):
+        if device_id not in self.names:
+            return None
+        return FakeDevice(device_id, self.names[device_id])
+
+    def report(self):
+        self.reports.report([self.device(i) for i in sorted(self.names)],
+                            0xff)
+        self.client.queried = []
+
+    def test_report_always_sends(self):
+        self.report()
+        self.report()
+        self.assertListEqual(self.client.reports, [["a", "b"], ["a", "b"]])
+
+    def test_changes_are_debounced(self):
+        self.report()
+        self.names[1] = "c"
+        for _ in range(10):
+            self.reports.changed(1, now=100)
+        self.reports.changed(2, now=100.5)
+        self.assertEqual(self.reports.timeout(100.5), 0.5)
+        self.assertFalse(self.reports.flush(100.5))
+        self.assertTrue(self.reports.flush(101))
+        self.assertListEqual(self.client.reports[-1], ["c", "b"])
+        self.assertListEqual(sorted(self.client.queried), [1, 2])
+        self.assertIs(self.reports.timeout(101), None)
+
+    def test_unchanged_not_reported(self):
+        self.report()
+        self.reports.changed(1, now=100)
+        self.assertFalse(self.reports.flush(101))
+        self.assertEqual(len(self.client.reports), 1)
+
+    def test_added_and_removed(self):
+        self.report()
+        self.names[3] = "d"
+        self.reports.changed(3, now=100)
+        self.reports.changed(1, removed=True, now=100)
+        self.assertTrue(self.reports.flush(101))
+        self.assertListEqual(self.client.reports[-1], ["b", "d"])
+        self.assertListEqual(self.client.queried, [3])
+
+    def test_event_updates_state(self):
+        self.report()
+        self.reports.event(1, 16, "128")
+        self.names[2] = "c"
+        self.reports.changed(2, now=100)
+        self.assertTrue(self.reports.flush(101))
+        self.assertDictEqual(self.client.device_lists[-1][0],
+                             {'id': 1, 'name': "a", 'state': 16,
+                              'stateValue': "128"})
+        self.assertEqual(self.client.device_lists[-1][1]['name'], "c")
+        self.assertListEqual(self.client.queried, [2])
+
+    def test_not_reported_before_report(self):
+        self.reports.changed(1, now=100)
+        self.assertFalse(self.reports.flush(101))
+        self.assertListEqual(self.client.reports, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import threading
+import unittest
+
+from tellive.commands import CommandQueue
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.executed = []
+        # Blocks the workers until set, so commands pile up in the queue
+        self.go = threading.Event()
+
+    def execute(self, device_id, action, value):
+        self.go.wait()
+        self.executed.append((device_id, action, value))
+
+    def test_order_per_device(self):
+        commands = CommandQueue(self.execute, workers=2)
+        commands.submit(1, "turnon")
+        commands.submit(2, "bell")
+        commands.submit(1, "learn")
+        commands.submit(1, "turnoff")
+        self.go.set()
+        commands.close()
+
+        self.assertListEqual(
+            [c for c in self.executed if c[0] == 1],
+            [(1, "turnon", None), (1, "learn", None), (1, "turnoff", None)])
+        self.assertIn((2, "bell", None), self.executed)
+
+    def test_collapse(self):
+        commands = CommandQueue(self.execute)
+        commands.submit(1, "bell")
+        commands.submit(1, "dim", 10)
+        commands.submit(1, "dim", 20)
+        commands.submit(2, "up")
+        commands.submit(1, "dim", 30)
+        commands.submit(2, "down")
+        # bell is either queued or being executed
+        self.assertIn(len(commands), (2, 3))
+        self.go.set()
+        commands.close()
+
+        # Devices take turns, so device 2 may run before dim on device 1
+        self.assertListEqual(sorted(self.executed), [
+            (1, "bell", None), (1, "dim", 30), (2, "down", None)])
+
+    def test_stop_does_not_replace_motion(self):
+        commands = CommandQueue(self.execute)
+        commands.submit(2, "bell")
+        commands.submit(1, "up")
+        commands.submit(1, "stop")
+        self.go.set()
+        commands.close()
+
+        self.assertListEqual([c for c in self.executed if c[0] == 1],
+                             [(1, "up", None), (1, "stop", None)])
+
+    def test_no_collapse_across_other_commands(self):
+        commands = CommandQueue(self.execute)
+        commands.submit(1, "bell")
+        commands.submit(1, "turnon")
+        commands.submit(1, "learn")
+        commands.submit(1, "turnoff")
+        self.go.set()
+        commands.close()
+
+        self.assertListEqual([c[1] for c in self.executed],
+                             ["bell", "turnon", "learn", "turnoff"])
+
+    def test_error_does_not_stop_worker(self):
+        def execute(device_id, action, value):
+            if action == "bell":
+                raise RuntimeError("No TellStick")
+            self.executed.append(action)
+
+        commands = CommandQueue(execute)
+        commands.submit(1, "bell")
+        commands.submit(1, "turnon")
+        commands.close()
+        self.assertListEqual(self.executed, ["turnon"])
+
+    def test_closed(self):
+        commands = CommandQueue(self.execute)
+        self.go.set()
+        commands.close()
+        self.assertRaises(RuntimeError, commands.submit, 1, "turnon")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import asyncio
+import http.client as http
+import unittest
+
+from tellive.httpresponse import MalformedResponse, read_response
+
+
+class Test(unittest.TestCase):
+    def respond(self, *responses):
+        """Read responses sent by a local server.
+
+        :return: list of the results of read_response()
+        """
+        async def run():
+            async def handle(reader, writer):
+                for response in responses:
+                    writer.write(response)
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                return [await read_response(reader) for _ in responses]
+            finally:
+                writer.close()
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(run())
+
+    def test_content_length(self):
+        first, second = self.respond(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello',
+            b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+        self.assertTupleEqual(first, (200, "OK", b'hello', False))
+        self.assertTupleEqual(second, (404, "Not Found", b'', False))
+
+    def test_chunked(self):
+        response, = self.respond(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+            b'Connection: close\r\n\r\n'
+            b'5;name=value\r\nhello\r\n6\r\n world\r\n0\r\n'
+            b'Trailer: x\r\n\r\n')
+        self.assertTupleEqual(response, (200, "OK", b'hello world', True))
+
+    def test_until_closed(self):
+        response, = self.respond(b'HTTP/1.0 200 OK\r\n\r\n{}')
+        self.assertTupleEqual(response, (200, "OK", b'{}', True))
+
+    def test_malformed_chunk_size(self):
+        self.assertRaises(
+            MalformedResponse, self.respond,
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'zz\r\nhello\r\n0\r\n\r\n')
+
+    def test_malformed_chunk_end(self):
+        self.assertRaises(
+            MalformedResponse, self.respond,
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'2\r\nhello\r\n0\r\n\r\n')
+
+    def test_malformed_content_length(self):
+        self.assertRaises(
+            MalformedResponse, self.respond,
+            b'HTTP/1.1 200 OK\r\nContent-Length: -1\r\n\r\n')
+
+    def test_malformed_status(self):
+        self.assertRaises(http.BadStatusLine, self.respond,
+                          b'garbage\r\n\r\n')
+        self.assertRaises(MalformedResponse, self.respond,
+                          b'HTTP/1.1 OK\r\n\r\n')
+
+    def test_closed_early(self):
+        self.assertRaises(
+            asyncio.IncompleteReadError, self.respond,
+            b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nhello')
+        self.assertRaises(ConnectionError, self.respond, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import os
+import tempfile
+import unittest
+
+from tellive.journal import Journal
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "test.journal")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def records(self, journal):
+        return [bytes(r) for r in journal.records()]
+
+    def test_append(self):
+        journal = Journal(self.path, 1024)
+        self.assertListEqual(self.records(journal), [])
+        journal.append(b'first')
+        journal.append(b'second')
+        self.assertListEqual(self.records(journal), [b'first', b'second'])
+        self.assertEqual(len(journal), 2)
+        journal.close()
+
+    def test_kept_when_reopened(self):
+        journal = Journal(self.path, 1024)
+        journal.append(b'first')
+        journal.close()
+
+        journal = Journal(self.path, 1024)
+        journal.append(b'second')
+        self.assertListEqual(self.records(journal), [b'first', b'second'])
+        journal.clear()
+        journal.close()
+
+        journal = Journal(self.path, 1024)
+        self.assertListEqual(self.records(journal), [])
+        journal.close()
+
+    def test_oldest_dropped_when_full(self):
+        journal = Journal(self.path, 256)
+        records = [bytes([65 + i % 26]) * 20 for i in range(50)]
+        for i, record in enumerate(records):
+            journal.append(record)
+            kept = self.records(journal)
+            self.assertEqual(kept[-1], record)
+            self.assertListEqual(kept, records[i + 1 - len(kept):i + 1])
+        # 24 bytes per record in 224 bytes of data
+        self.assertGreaterEqual(len(journal), 8)
+        journal.close()
+
+    def test_record_too_large(self):
+        journal = Journal(self.path, 256)
+        self.assertRaises(ValueError, journal.append, b'x' * 256)
+        self.assertRaises(ValueError, journal.append, b'')
+        journal.close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage' * 100)
+        journal = Journal(self.path, 1024)
+        self.assertListEqual(self.records(journal), [])
+        journal.append(b'first')
+        self.assertListEqual(self.records(journal), [b'first'])
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import threading
+import unittest
+
+from tellive.live import BACKGROUND, INTERACTIVE, RateLimiter, \
+    TelldusLive, TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        super().__init__()
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeClient(object):
+    """Answers requests from a dict of device id -> params."""
+    def __init__(self, devices):
+        super().__init__()
+        self.devices = devices
+        self.requests = []
+
+    def request(self, method, params):
+        self.requests.append((method, params.get('id')))
+        if method == "devices/list":
+            return {'device': [dict(p, id=id)
+                               for id, p in self.devices.items()]}
+        if method == "device/info":
+            return dict(self.devices[params['id']], id=params['id'])
+        return {'status': "success"}
+
+    def methods(self):
+        return [method for method, _ in self.requests]
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = FakeClient({1: {'name': "lamp", 'state': 2},
+                                  2: {'name': "fan", 'state': 2}})
+        self.live = TelldusLive(self.client, cache_ttl=60, rate_limit=None,
+                                clock=self.clock)
+
+    def test_devices_share_one_request(self):
+        devices = self.live.devices()
+        self.assertListEqual([d.name for d in devices], ["lamp", "fan"])
+        self.assertListEqual([d.last_sent_command() for d in devices],
+                             [2, 2])
+        self.assertListEqual(self.client.methods(), ["devices/list"])
+
+    def test_cache_ttl(self):
+        self.live.device_params(1)
+        self.clock.now += 60
+        self.live.device_params(1)
+        self.assertListEqual(self.client.methods(), ["devices/list"])
+
+        self.client.devices[1]['state'] = 1
+        self.clock.now += 1
+        self.assertEqual(self.live.device_params(1)['state'], 1)
+        self.assertListEqual(self.client.methods(), ["devices/list"] * 2)
+
+    def test_invalidate_device(self):
+        self.live.device_params(1)
+        self.client.devices[1]['state'] = 1
+        self.client.devices[2]['state'] = 1
+        self.live.invalidate(1)
+        self.assertEqual(self.live.device_params(1)['state'], 1)
+        self.assertEqual(self.live.device_params(2)['state'], 2)
+        self.assertListEqual(self.client.requests,
+                             [("devices/list", None), ("device/info", 1)])
+
+        # Refreshed only once
+        self.live.device_params(1)
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_invalidate_all(self):
+        self.live.device_params(1)
+        self.live.invalidate()
+        self.live.device_params(1)
+        self.assertListEqual(self.client.methods(), ["devices/list"] * 2)
+
+    def test_command_invalidates(self):
+        device, _ = self.live.devices()
+        device.turn_on()
+        self.client.devices[1]['state'] = 1
+        self.assertEqual(device.last_sent_command(), 1)
+        self.assertListEqual(self.client.requests,
+                             [("devices/list", None), ("device/turnOn", 1),
+                              ("device/info", 1)])
+
+    def test_refresh_all(self):
+        self.live.device_params(1)
+        self.live.invalidate(2)
+        del self.client.devices[1]
+        self.client.devices[3] = {'name': "heater", 'state': 1}
+        self.live.refresh_all()
+        self.assertDictEqual(self.live.device_params(1), {})
+        self.assertEqual(self.live.device_params(3)['name'], "heater")
+        # The refresh made device 2 up to date
+        self.live.device_params(2)
+        self.assertListEqual(self.client.methods(), ["devices/list"] * 2)
+
+    def test_unknown_device(self):
+        self.assertDictEqual(self.live.device_params(4), {})
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst(self):
+        bucket = TokenBucket(2, burst=3, clock=self.clock)
+        self.assertListEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+    def test_refill_limited_to_burst(self):
+        bucket = TokenBucket(10, burst=2, clock=self.clock)
+        bucket.take()
+        self.clock.now += 100
+        self.assertListEqual([bucket.take() for _ in range(3)],
+                             [0, 0, 0.1])
+
+    def test_priority(self):
+        bucket = TokenBucket(1, burst=1, clock=self.clock)
+        bucket.take()
+        self.clock.now += 1
+        # A background request must wait while a command is waiting
+        bucket.waiting[INTERACTIVE] += 1
+        self.assertGreater(bucket.take(BACKGROUND), 0)
+        self.assertEqual(bucket.take(INTERACTIVE), 0)
+        bucket.waiting[INTERACTIVE] -= 1
+
+        self.clock.now += 1
+        bucket.waiting[BACKGROUND] += 1
+        self.assertEqual(bucket.take(INTERACTIVE), 0)
+
+    def test_acquire(self):
+        limiter = RateLimiter(1000, burst=2, clock=self.clock)
+        limiter.acquire()
+        limiter.acquire(BACKGROUND)
+
+        thread = threading.Thread(target=limiter.acquire, daemon=True)
+        thread.start()
+        thread.join(0.05)
+        # Blocked until time has passed
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(limiter.waiting[INTERACTIVE], 1)
+        self.clock.now += 0.002
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(limiter.waiting[INTERACTIVE], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,7 +17,8 @@
 
 import unittest
 
-from tellive.livemessage import LiveMessageToken
+from tellive.livemessage import LiveMessage, LiveMessageDecoder, \
+    LiveMessageToken
 
 
 class Test(unittest.TestCase):
@@ -101,6 +102,8 @@ class Test(unittest.TestCase):
         self.assertIs(None, LiveMessageToken.deserialize(b'hi1s')[0])
         self.assertIs(None, LiveMessageToken.deserialize(b'u')[0])
         self.assertIs(None, LiveMessageToken.deserialize(b'u7:YWxpdmU')[0])
+        self.assertIs(None, LiveMessageToken.deserialize(b'5:foo')[0])
+        self.assertIs(None, LiveMessageToken.deserialize(b'li1s')[0])
 
     def test_deserialize_int(self):
         (token, rest) = LiveMessageToken.deserialize(b'i1A2s')
@@ -153,6 +156,111 @@ class Test(unittest.TestCase):
         self.assert_string(token, "123456789abcdefP")
         self.assertFalse(rest)
 
+    def test_deserialize_rest(self):
+        (token, rest) = LiveMessageToken.deserialize(b'3:fooi1s')
+        self.assert_string(token, "foo")
+        self.assertEqual(rest, b'i1s')
+
+    def test_serialize_message(self):
+        message = LiveMessage("Ping")
+        message.append([1, b'a'])
+        self.assertEqual(message.serialize(), b'4:Pingli1su4:YQ==s')
+
+        buffer = bytearray(b'xx')
+        self.assertIs(message.serialize(buffer), buffer)
+        self.assertEqual(buffer, b'xx4:Pingli1su4:YQ==s')
+
+    def test_serialize_unknown_type(self):
+        message = LiveMessage("Ping")
+        message.append(1.5)
+        self.assertRaises(RuntimeError, message.serialize)
+
+    def test_serialize_signed(self):
+        message = LiveMessage("Ping")
+        message.append({'a': "b\xe5"})
+        for hash_method in ("sha1", "sha256", "sha512"):
+            envelope = message.create_signed_message("key", hash_method)
+            self.assertEqual(message.serialize_signed("key", hash_method),
+                             envelope.serialize())
+            self.assertTrue(envelope.verify_signature("key", hash_method))
+
+    def test_deserialize_message(self):
+        message = LiveMessage.deserialize(b'4:Pingh1:ali1s2:bcssi2s')
+        self.assertEqual(message.subject(), "ping")
+        self.assertDictEqual(message.parameter(0), {'a': [1, "bc"]})
+        self.assertEqual(message.parameter(1), 2)
+
+    def test_deserialize_message_range(self):
+        message = LiveMessage.deserialize(b'xx4:Pingi1sxx', 2, 11)
+        self.assertListEqual(message.tokens, ["Ping", 1])
+
+    def test_deserialize_message_invalid(self):
+        message = LiveMessage.deserialize(b'4:Pingi1s5:foo')
+        self.assertListEqual(message.tokens, ["Ping", 1])
+
+    def test_deserialize_large_message(self):
+        devices = [{'id': i, 'name': "Device {}".format(i)}
+                   for i in range(2000)]
+        message = LiveMessage("DevicesReport")
+        message.append(devices)
+        message = LiveMessage.deserialize(message.serialize())
+        self.assertListEqual(message.parameter(0), devices)
+
+
+class DecoderTest(unittest.TestCase):
+    def envelope(self, payload):
+        message = LiveMessage("signature")
+        message.append(payload)
+        return message.serialize()
+
+    def test_empty(self):
+        decoder = LiveMessageDecoder()
+        self.assertListEqual(decoder.envelopes(), [])
+
+    def test_one_envelope(self):
+        decoder = LiveMessageDecoder()
+        decoder.feed(self.envelope("4:Ping"))
+        envelopes = decoder.envelopes()
+        self.assertEqual(len(envelopes), 1)
+        self.assertListEqual(envelopes[0].tokens, ["signature", "4:Ping"])
+        self.assertFalse(decoder.buffer)
+
+    def test_coalesced_envelopes(self):
+        decoder = LiveMessageDecoder()
+        decoder.feed(self.envelope("a") + self.envelope("b"))
+        envelopes = decoder.envelopes()
+        self.assertListEqual([e.parameter(0) for e in envelopes], ["a", "b"])
+
+    def test_split_envelope(self):
+        data = self.envelope("4:Ping") + self.envelope("4:Pong")
+        decoder = LiveMessageDecoder()
+        received = []
+        for i in range(len(data)):
+            decoder.feed(data[i:i + 1])
+            received.extend(e.parameter(0) for e in decoder.envelopes())
+        self.assertListEqual(received, ["4:Ping", "4:Pong"])
+        self.assertFalse(decoder.buffer)
+
+    def test_invalid_envelope(self):
+        decoder = LiveMessageDecoder()
+        decoder.feed(b'i1si2s')
+        self.assertRaises(ValueError, decoder.envelopes)
+
+    def test_frames(self):
+        decoder = LiveMessageDecoder()
+        partial = self.envelope("4:Pong")[:-2]
+        decoder.feed(self.envelope("4:Ping") + partial)
+        frames = []
+        for signature, start, stop in decoder.frames():
+            frames.append((signature, bytes(decoder.buffer[start:stop])))
+        self.assertListEqual(frames, [("signature", b"4:Ping")])
+        self.assertEqual(decoder.buffer, partial)
+
+    def test_frames_base64_payload(self):
+        decoder = LiveMessageDecoder()
+        decoder.feed(self.envelope(b"4:Ping"))
+        self.assertRaises(ValueError, list, decoder.frames())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import os
+import tempfile
+import unittest
+
+from tellive import metrics
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("sent_total", "Sent", ["subject"])
+        counter.inc("Ping")
+        counter.inc("Ping")
+        counter.inc("Reg\"ister", amount=3)
+        self.assertEqual(self.registry.render(),
+                         '# HELP sent_total Sent\n'
+                         '# TYPE sent_total counter\n'
+                         'sent_total{subject="Ping"} 2\n'
+                         'sent_total{subject="Reg\\"ister"} 3\n')
+
+    def test_same_metric_returned(self):
+        counter = self.registry.counter("sent_total", "Sent")
+        self.assertIs(self.registry.counter("sent_total", "Sent"), counter)
+        self.assertRaises(ValueError, self.registry.gauge, "sent_total", "")
+
+    def test_gauge_function(self):
+        gauge = self.registry.gauge("depth", "Depth", ["queue"])
+        items = [1, 2]
+        gauge.set_function(lambda: len(items), "send")
+        gauge.set(5, "other")
+        self.assertIn('depth{queue="send"} 2', self.registry.render())
+        items.append(3)
+        self.assertIn('depth{queue="send"} 3', self.registry.render())
+
+        gauge.set_function(None, "send")
+        self.assertNotIn('queue="send"', self.registry.render())
+        self.assertIn('depth{queue="other"} 5', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("seconds", "Time",
+                                            buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(2.0)
+        self.assertEqual(self.registry.render(),
+                         '# HELP seconds Time\n'
+                         '# TYPE seconds histogram\n'
+                         'seconds_bucket{le="0.1"} 1\n'
+                         'seconds_bucket{le="1"} 2\n'
+                         'seconds_bucket{le="+Inf"} 3\n'
+                         'seconds_sum 2.55\n'
+                         'seconds_count 3\n')
+
+    def test_write_textfile(self):
+        self.registry.counter("sent_total", "Sent").inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tellive.prom")
+            metrics.write_textfile(path, self.registry)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.registry.render())
+            self.assertListEqual(os.listdir(directory), ["tellive.prom"])
+
+
+if __name__ == '__main__':
+    unittest.main()
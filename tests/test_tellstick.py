@@ -0,0 +1,402 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import os
+import ssl
+import tempfile
+import time
+import unittest
+
+from tellive.journal import Journal
+from tellive.livemessage import LiveMessage, LiveMessageDecoder
+from tellive.tellstick import TellstickLiveClient
+
+
+class FakeSocket(object):
+    session = None
+
+    def __init__(self, address=None, send_size=None):
+        super().__init__()
+        self.address = address
+        self.closed = False
+        self.send_size = send_size
+        self.sent = []
+        self.timeout = 5
+        # Data (or exceptions) returned by read()
+        self.reads = []
+        # Exception to raise in send()
+        self.send_error = None
+
+    def close(self):
+        self.closed = True
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0.0
+
+    def send(self, data):
+        if self.send_error:
+            raise self.send_error
+        data = bytes(data[:self.send_size])
+        self.sent.append(data)
+        return len(data)
+
+    def read(self, size):
+        if not self.reads:
+            raise ssl.SSLWantReadError()
+        result = self.reads.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def pending(self):
+        return 0
+
+
+class Client(TellstickLiveClient):
+    CONNECT_DELAY = 0.01
+
+    def __init__(self, servers, delays):
+        super().__init__("public", "private")
+        self.server_list = servers
+        self.delays = delays
+        self.fetched = 0
+        self.sockets = []
+
+    def servers(self):
+        self.fetched += 1
+        return list(self.server_list)
+
+    def _connect_socket(self, address, timeout):
+        delay = self.delays.get(address)
+        if delay is None:
+            raise OSError("Connection refused")
+        time.sleep(delay)
+        sock = FakeSocket(address)
+        self.sockets.append(sock)
+        return sock
+
+
+class Test(unittest.TestCase):
+    A = ("a", 1)
+    B = ("b", 2)
+    C = ("c", 3)
+
+    def test_server_cache(self):
+        client = Client([self.A, self.B], {})
+        self.assertListEqual(client.cached_servers(), [self.A, self.B])
+        self.assertListEqual(client.cached_servers(), [self.A, self.B])
+        self.assertEqual(client.fetched, 1)
+
+        client.server_cache_time -= client.SERVER_CACHE_TTL + 1
+        client.server_list = [self.B, self.C]
+        self.assertListEqual(client.cached_servers(), [self.B, self.C])
+        self.assertEqual(client.fetched, 2)
+
+    def test_connect_to_fastest(self):
+        client = Client([self.A, self.B, self.C],
+                        {self.A: 0.5, self.B: 0.05})
+        self.assertEqual(client.connect_to_first_available_server(), self.B)
+        self.assertIs(client.socket.address, self.B)
+
+        # The last used server is tried first next time
+        self.assertListEqual(client.cached_servers(),
+                             [self.B, self.A, self.C])
+
+        # The slower connection is closed when it completes
+        time.sleep(0.6)
+        closed = [s.address for s in client.sockets if s.closed]
+        self.assertListEqual(closed, [self.A])
+
+    def test_ssl_context_is_shared(self):
+        client = Client([], {})
+        self.assertIs(client.ssl_context(), client.ssl_context())
+
+    def test_session_saved(self):
+        client = Client([self.A], {self.A: 0})
+        client.connect_to_first_available_server()
+        client.socket.session = "session"
+        client.disconnect()
+        self.assertDictEqual(client.sessions, {self.A: "session"})
+
+    def test_connect_fails(self):
+        client = Client([self.A, self.B], {})
+        self.assertRaises(RuntimeError,
+                          client.connect_to_first_available_server)
+        self.assertIs(client.socket, None)
+        # The server list is fetched again on the next attempt
+        client.cached_servers()
+        self.assertEqual(client.fetched, 2)
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TellstickLiveClient("public", "private",
+                                          send_queue_size=3)
+        self.client.socket = FakeSocket()
+
+    def messages(self):
+        decoder = LiveMessageDecoder()
+        decoder.feed(b''.join(self.client.socket.sent))
+        return [LiveMessage.deserialize(e.parameter(0).encode('utf-8'))
+                for e in decoder.envelopes()]
+
+    def report(self, sensor_id, values):
+        self.client.report_sensor_event("oregon", "ea4c", sensor_id,
+                                        [(t, v, 0) for t, v in values])
+
+    def test_messages_are_queued(self):
+        self.client.ping()
+        self.client.acknowledge(1)
+        self.assertTrue(self.client.wants_write())
+        self.assertListEqual(self.client.socket.sent, [])
+
+        self.client.write_pending()
+        self.assertEqual(len(self.client.socket.sent), 1)
+        self.assertListEqual([m.subject() for m in self.messages()],
+                             ["ping", "ack"])
+        self.assertFalse(self.client.wants_write())
+
+    def test_partial_write(self):
+        self.client.socket.send_size = 5
+        self.client.ping()
+        while self.client.wants_write():
+            self.client.write_pending()
+        self.assertListEqual([m.subject() for m in self.messages()],
+                             ["ping"])
+
+    def test_newest_sensor_value_kept(self):
+        self.report(1, [(1, "20")])
+        self.report(2, [(1, "30")])
+        self.report(1, [(1, "21"), (2, "50")])
+        self.client.write_pending()
+        messages = self.messages()
+        self.assertEqual(len(messages), 2)
+        self.assertListEqual(
+            [(v['type'], v['value']) for v in messages[0].parameter(1)],
+            [(1, "21"), (2, "50")])
+
+    def test_full_queue_drops_sensor_event(self):
+        self.report(1, [(1, "20")])
+        self.client.ping()
+        self.client.ping()
+        self.client.ping()
+        self.client.write_pending()
+        self.assertListEqual([m.subject() for m in self.messages()],
+                             ["ping"] * 3)
+
+    def test_full_queue_writes(self):
+        for _ in range(4):
+            self.client.ping()
+        self.client.write_pending()
+        self.assertEqual(len(self.messages()), 4)
+
+
+class NonBlockingTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TellstickLiveClient("public", "private",
+                                          send_queue_size=3)
+        self.socket = FakeSocket()
+        self.client._connected(("server", 1), self.socket)
+
+    def pong(self):
+        return LiveMessage("pong").serialize_signed("private", "sha1")
+
+    def test_socket_is_non_blocking(self):
+        self.assertEqual(self.socket.gettimeout(), 0.0)
+        self.assertEqual(self.client.timeout, 5)
+
+        # Without the send queue the socket is used in blocking mode
+        client = TellstickLiveClient("public", "private")
+        client._connected(("server", 1), FakeSocket())
+        self.assertEqual(client.socket.gettimeout(), 5)
+
+    def test_nothing_to_read(self):
+        self.assertListEqual(self.client.receive_messages(), [])
+        self.socket.reads = [self.pong()[:5], self.pong()[5:]]
+        self.assertListEqual(self.client.receive_messages(), [])
+        self.assertListEqual(
+            [m.subject() for m in self.client.receive_messages()], ["pong"])
+
+    def test_write_would_block(self):
+        self.client.ping()
+        self.socket.send_error = ssl.SSLWantWriteError()
+        self.assertEqual(self.client.write_pending(), 0)
+        self.assertTrue(self.client.waits_for_writable())
+
+        self.socket.send_error = None
+        self.assertGreater(self.client.write_pending(), 0)
+        self.assertFalse(self.client.waits_for_writable())
+
+    def test_write_wants_read(self):
+        self.client.ping()
+        self.socket.send_error = ssl.SSLWantReadError()
+        self.assertEqual(self.client.write_pending(), 0)
+        # Wait for the socket to be readable instead
+        self.assertTrue(self.client.wants_write())
+        self.assertFalse(self.client.waits_for_writable())
+
+        self.socket.send_error = None
+        self.client.receive_messages()
+        self.assertTrue(self.client.waits_for_writable())
+        self.client.write_pending()
+        self.assertFalse(self.client.wants_write())
+
+    def test_read_wants_write(self):
+        self.socket.reads = [ssl.SSLWantWriteError(), self.pong()]
+        self.assertListEqual(self.client.receive_messages(), [])
+        self.assertFalse(self.client.wants_write())
+        self.assertTrue(self.client.waits_for_writable())
+
+        # The read continues once the socket is writable
+        self.client.write_pending()
+        self.assertFalse(self.client.waits_for_writable())
+        self.assertListEqual(
+            [m.subject() for m in self.client.receive_messages()], ["pong"])
+
+
+class ReceiveTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TellstickLiveClient("public", "private")
+
+    def signed(self, subject, key="private"):
+        message = LiveMessage(subject)
+        message.append({'id': 1})
+        return message.serialize_signed(key, "sha1")
+
+    def test_decode_received(self):
+        self.client.decoder.feed(self.signed("command") + self.signed("pong"))
+        self.client._decode_received()
+        self.assertListEqual([m.subject() for m in self.client.received],
+                             ["command", "pong"])
+        self.assertEqual(self.client.received[0].parameter(0), {'id': 1})
+        self.assertFalse(self.client.decoder.buffer)
+
+    def test_invalid_signature(self):
+        self.client.decoder.feed(self.signed("command", key="other"))
+        self.assertRaises(ValueError, self.client._decode_received)
+        self.assertFalse(self.client.received)
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = Journal(
+            os.path.join(self.directory.name, "test.journal"), 4096)
+        self.client = TellstickLiveClient("public", "private",
+                                          send_queue_size=10,
+                                          journal=self.journal)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_events_replayed_once_registered(self):
+        self.client.report_device_event(1, 1, "")
+        self.client.report_sensor_event("oregon", "ea4c", 1,
+                                        [(1, "21.0", 10), (2, "40", 10)])
+        self.client.report_device_event(2, 2, "")
+        self.client.report_sensor_event("oregon", "ea4c", 1,
+                                        [(1, "21.5", 20)])
+        self.assertEqual(len(self.journal), 4)
+        self.assertFalse(self.client.wants_write())
+
+        self.client.socket = FakeSocket()
+        self.client.ping()
+        self.assertEqual(self.client.replay_journal(), 3)
+        self.assertEqual(len(self.journal), 0)
+
+        messages = list(self.client.send_queue.values())
+        self.assertListEqual(
+            [m.subject() for m in messages],
+            ["ping", "deviceevent", "deviceevent", "sensorevent"])
+        self.assertListEqual(
+            [(v['type'], v['value']) for v in messages[3].parameter(1)],
+            [(1, "21.5"), (2, "40")])
+
+        # Sent directly until disconnected
+        self.client.report_device_event(3, 1, "")
+        self.assertEqual(len(self.journal), 0)
+        self.client.write_pending()
+        self.client.disconnect()
+        self.client.report_device_event(4, 1, "")
+        self.assertEqual(len(self.journal), 1)
+
+    def test_queued_events_journaled_on_disconnect(self):
+        self.client.socket = FakeSocket()
+        self.client.replay_journal()
+        self.client.ping()
+        self.client.report_device_event(1, 1, "")
+        self.client.report_sensor_event("oregon", "ea4c", 1,
+                                        [(1, "21.0", 10)])
+        self.client.disconnect()
+        self.assertFalse(self.client.wants_write())
+        self.assertListEqual(
+            [LiveMessage.deserialize(r).subject()
+             for r in self.journal.records()],
+            ["deviceevent", "sensorevent"])
+
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TellstickLiveClient("public", "private",
+                                          send_queue_size=10)
+        self.client.socket = FakeSocket()
+        self.client.report_hashes = {}
+        self.devices = [{'id': 1, 'name': "Lamp", 'state': 1}]
+
+    def sent(self):
+        self.client.write_pending()
+        return len(self.client.socket.sent)
+
+    def test_unchanged_report_not_sent(self):
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 1)
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 1)
+        self.devices[0]['state'] = 2
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 2)
+        self.assertIn("devicesreport", self.client.report_hashes)
+
+    def test_old_report_sent_again(self):
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 1)
+        self.client.report_hashes["devicesreport"][1] -= \
+            self.client.REPORT_MAX_AGE
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 2)
+
+    def test_always_sent_without_hashes(self):
+        self.client.report_hashes = None
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 1)
+        self.client.report_device_list(self.devices)
+        self.assertEqual(self.sent(), 2)
+
+    def test_hashes_cleared_if_not_written(self):
+        self.client.socket.send_size = 0
+        self.client.report_device_list(self.devices)
+        self.client.write_pending()
+        self.assertTrue(self.client.wants_write())
+        self.client.disconnect()
+        self.assertDictEqual(self.client.report_hashes, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright (c) 2014 Erik Johansson <erik@ejohansson.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+# USA
+
+import os
+import tempfile
+import unittest
+
+from tellive.timeseries import TimeSeries, TimeSeriesStore
+
+# Room for 10 readings
+SIZE = 32 + 10 * 16
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "test.ts")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append(self):
+        series = TimeSeries(self.path, SIZE)
+        self.assertIsNone(series.last())
+        series.append(100, 21.5)
+        series.append(110, 22.0)
+        self.assertEqual(len(series), 2)
+        self.assertEqual(series.last(), (110, 22.0))
+        timestamps, values = series.range()
+        self.assertListEqual(list(timestamps), [100, 110])
+        self.assertListEqual(list(values), [21.5, 22.0])
+        series.close()
+
+    def test_kept_when_reopened(self):
+        series = TimeSeries(self.path, SIZE)
+        series.append(100, 1.0)
+        series.close()
+
+        series = TimeSeries(self.path, SIZE)
+        self.assertEqual(series.last(), (100, 1.0))
+        series.close()
+
+    def test_oldest_overwritten_when_full(self):
+        series = TimeSeries(self.path, SIZE)
+        for i in range(25):
+            series.append(i, float(i))
+        self.assertEqual(len(series), 10)
+        self.assertEqual(series.last(), (24, 24.0))
+        timestamps, values = series.range()
+        self.assertListEqual(list(timestamps), list(range(15, 25)))
+        self.assertListEqual(list(values), [float(i) for i in range(15, 25)])
+        series.close()
+
+    def test_range(self):
+        series = TimeSeries(self.path, SIZE)
+        for i in range(13):
+            series.append(i * 10, float(i))
+        self.assertListEqual(list(series.range(45, 80)[0]), [50, 60, 70, 80])
+        self.assertListEqual(list(series.range(None, 40)[0]), [30, 40])
+        self.assertListEqual(list(series.range(200)[0]), [])
+        series.close()
+
+    def test_downsample(self):
+        series = TimeSeries(self.path, SIZE)
+        for timestamp, value in [(0, 1.0), (5, 3.0), (10, 2.0), (30, 4.0)]:
+            series.append(timestamp, value)
+        self.assertListEqual(series.downsample(10),
+                             [(0, 1.0, 3.0, 2.0), (10, 2.0, 2.0, 2.0),
+                              (30, 4.0, 4.0, 4.0)])
+        self.assertListEqual(series.downsample(60, 5, 10),
+                             [(0, 2.0, 3.0, 2.5)])
+        series.close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage' * 100)
+        series = TimeSeries(self.path, SIZE)
+        self.assertIsNone(series.last())
+        series.close()
+
+    def test_store(self):
+        store = TimeSeriesStore(self.directory.name, SIZE)
+        store.append("oregon/ea4c.78", 1, 100, 21.5)
+        store.append("oregon/ea4c.78", 2, 100, 40.0)
+        self.assertEqual(store.series("oregon/ea4c.78", 2).last(),
+                         (100, 40.0))
+        self.assertListEqual(store.keys(), [("oregon/ea4c.78", 1),
+                                            ("oregon/ea4c.78", 2)])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()